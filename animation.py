@@ -0,0 +1,128 @@
+import numpy as np
+import tiledata
+
+# Animated maps are stored as the tile data and tile map of the first frame,
+# followed by patches turning each frame into the next. Tiles keep their VRAM
+# slot between frames, so only slots whose tile changed are copied again.
+# The patches of the first frame turn the last frame back into the first,
+# so the animation can loop.
+#
+# A tile patch is the tile number followed by the 16 bytes of the tile. A map
+# patch is the row-major offset into the tile map, low byte first, followed
+# by the tile number.
+
+TILE_PATCH_SIZE = 17
+MAP_PATCH_SIZE = 3
+
+
+def encode_frames(frames, tiles_x, tiles_y):
+    # frames is an (F, height, width) array of DMG color indices. Returns the
+    # packed tiles of all frames as an (F, N, 16) array in row-major order.
+    frames = np.asarray(frames, np.uint8)[:, :tiles_y*8, :tiles_x*8]
+    td = frames.reshape(-1, tiles_y, 8, tiles_x, 8).transpose(0, 1, 3, 2, 4).reshape(-1, 8, 8)
+    return tiledata.encode_2bpp(td).reshape(len(frames), tiles_x * tiles_y, 16)
+
+
+def assign_slots(encoded):
+    # Assigns each unique tile of each frame to a VRAM slot. Tiles keep their
+    # slot while they are in use and new tiles take freed slots first.
+    # Returns the contents of each slot as an (F, S, 16) array, the number of
+    # slots used by each frame and the tile map of each frame.
+    frame_count, count = encoded.shape[:2]
+    # number the distinct tiles of all frames at once, so frames are compared
+    # and slots assigned by tile number instead of tile data
+    pairs = np.ascontiguousarray(encoded, np.uint8).reshape(-1, 16).view(np.uint64)
+    tiles, ids = np.unique(pairs, axis=0, return_inverse=True)
+    tiles = tiles.view(np.uint8).reshape(-1, 16)
+    ids = ids.reshape(frame_count, count)
+
+    changed = np.ones((frame_count, count), bool)
+    changed[1:] = ids[1:] != ids[:-1]
+
+    slot_of = np.full(len(tiles), -1, np.intp)
+    contents = np.zeros(0, np.intp)
+    indices = np.zeros(count, np.intp)
+    maps = np.zeros((frame_count, count), np.intp)
+    slots = []
+    for f in range(frame_count):
+        dirty = np.flatnonzero(changed[f])
+        new = ids[f, dirty]
+
+        # tiles not in a slot get numbers past the end in order of appearance
+        missing = slot_of[new] < 0
+        added, first = np.unique(new[missing], return_index=True)
+        added = added[np.argsort(first)]
+        used_count = len(contents)
+        slot_of[added] = used_count + np.arange(len(added))
+        indices[dirty] = slot_of[new]
+
+        used = np.zeros(used_count + len(added), bool)
+        used[indices] = True
+        free = np.flatnonzero(~used[:used_count])
+        n = min(len(free), len(added))
+        slot_of[contents[free[:n]]] = -1
+        slot_of[added[:n]] = free[:n]
+        slot_of[added[n:]] = used_count + np.arange(len(added) - n)
+        contents = np.concatenate((contents, added[n:]))
+        contents[free[:n]] = added[:n]
+        indices[dirty] = slot_of[new]
+
+        # unused slots at the end are dropped
+        end = indices.max() + 1 if count > 0 else 0
+        slot_of[contents[end:]] = -1
+        contents = contents[:end]
+
+        maps[f] = indices
+        slots.append(contents)
+
+    counts = np.array([len(s) for s in slots], np.intp)
+    data = np.zeros((frame_count, counts.max(initial=0), 16), np.uint8)
+    for f, s in enumerate(slots):
+        data[f, :len(s)] = tiles[s]
+    return data, counts, maps
+
+
+def deltas(slots, counts, maps, offset=0):
+    # Compares each frame with the one before it, the first frame with the
+    # last. Slots past the end of the previous frame are always copied as
+    # their content is unknown. Returns the tile patches and map patches of
+    # all frames as byte arrays, along with the index of the first patch of
+    # each frame and the end of the last.
+    frame_count, slot_count = slots.shape[:2]
+    slot = np.arange(slot_count)
+
+    tile_changed = (slots != np.roll(slots, 1, axis=0)).any(axis=2) | (slot >= np.roll(counts, 1)[:, None])
+    tile_changed &= slot < counts[:, None]
+    map_changed = maps != np.roll(maps, 1, axis=0)
+
+    tf, ts = np.nonzero(tile_changed)
+    mf, mi = np.nonzero(map_changed)
+
+    tile_patches = np.hstack((ts[:, None] + offset, slots[tf, ts]))
+    map_patches = np.stack((mi & 0xFF, mi >> 8, maps[mf, mi] + offset), axis=1)
+
+    frame = np.arange(frame_count + 1)
+    return tile_patches, np.searchsorted(tf, frame), map_patches, np.searchsorted(mf, frame)
+
+
+def build(frames, tiles_x, tiles_y, offset=0):
+    # Returns the tile data and tile map of the first frame, the number of
+    # slots needed and the patches as returned by deltas.
+    slots, counts, maps = assign_slots(encode_frames(frames, tiles_x, tiles_y))
+    if len(counts) > 0 and counts.max() + offset > 256:
+        raise ValueError("Animation needs {} tile slots, tile numbers exceed 255.".format(counts.max() + offset))
+
+    tile_patches, tile_bounds, map_patches, map_bounds = deltas(slots, counts, maps, offset)
+    # patch indices hold byte offsets in 16-bit words
+    for patches, size, kind in ((tile_patches, TILE_PATCH_SIZE, "tile"), (map_patches, MAP_PATCH_SIZE, "map")):
+        if len(patches) * size > 0xFFFF:
+            raise ValueError("Animation has {} bytes of {} patches, more than the 65535 the patch index can address.".format(len(patches) * size, kind))
+    tile_data = slots[0, :counts[0]].reshape(-1)
+    return tile_data, maps[0] + offset, int(counts.max()), tile_patches, tile_bounds, map_patches, map_bounds
+
+
+def report(frame_count, tiles, slot_count, tile_patches, map_patches):
+    full = frame_count * (slot_count * 16 + len(tiles))
+    patches = len(tile_patches) * TILE_PATCH_SIZE + len(map_patches) * MAP_PATCH_SIZE
+    return "{} frames, {} tile slots, {} tile patches and {} map patches ({} bytes) instead of {} bytes of full frames.".format(
+        frame_count, slot_count, len(tile_patches), len(map_patches), patches, full)
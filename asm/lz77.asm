@@ -0,0 +1,51 @@
+; LZ77 decompressor for data produced by lz77.py (RGBDS syntax), for
+; assembly projects. GBDK/SDCC projects use lz77_sdcc.s or lz77.c instead,
+; as RGBDS objects can not be linked with the SDCC linker.
+;
+; In:  hl = compressed data
+;      de = destination
+; Out: de = end of decompressed data
+; Destroys: af, bc, hl
+
+SECTION "lz77_decompress", ROM0
+
+lz77_decompress::
+.command:
+    ld a, [hl+]
+    or a
+    ret z               ; 0x00: end of stream
+    bit 7, a
+    jr nz, .match
+
+    ld c, a             ; 0x01-0x7F: copy c literal bytes
+.literal:
+    ld a, [hl+]
+    ld [de], a
+    inc de
+    dec c
+    jr nz, .literal
+    jr .command
+
+.match:                 ; 0x80-0xFF: copy (a & 0x7F) + 4 bytes from de - distance
+    and $7F
+    add 4
+    ld c, a
+    ld a, [hl+]
+    ld b, a             ; distance low byte
+    ld a, [hl+]         ; distance high byte
+    push hl
+    ld h, a
+    ld a, e
+    sub b
+    ld l, a
+    ld a, d
+    sbc h
+    ld h, a
+.copy:
+    ld a, [hl+]
+    ld [de], a
+    inc de
+    dec c
+    jr nz, .copy
+    pop hl
+    jr .command
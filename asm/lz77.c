@@ -0,0 +1,26 @@
+/* Portable C version of lz77_sdcc.s, for builds without the assembly
+   decoder. Compile with -DLZ77_C under SDCC. */
+#include "lz77.h"
+
+unsigned char *lz77_decompress(unsigned char *dst, const unsigned char *src)
+{
+    unsigned char n;
+    const unsigned char *from;
+
+    while ((n = *src++) != 0) {
+        if (n & 0x80) {
+            /* match of (n & 0x7F) + 4 bytes, may overlap its own output */
+            from = dst - (src[0] | (src[1] << 8));
+            src += 2;
+            n = (n & 0x7F) + 4;
+            while (n--) {
+                *dst++ = *from++;
+            }
+        } else {
+            while (n--) {
+                *dst++ = *src++;
+            }
+        }
+    }
+    return dst;
+}
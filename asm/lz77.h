@@ -0,0 +1,13 @@
+#ifndef LZ77_H
+#define LZ77_H
+
+/* Decompresses data produced by lz77.py to dst and returns the end of the
+   decompressed data. Implemented in lz77_sdcc.s, or in lz77.c for other
+   compilers. */
+#if defined(__SDCC) && !defined(LZ77_C)
+unsigned char *lz77_decompress(unsigned char *dst, const unsigned char *src) __sdcccall(1);
+#else
+unsigned char *lz77_decompress(unsigned char *dst, const unsigned char *src);
+#endif
+
+#endif
@@ -0,0 +1,60 @@
+;; LZ77 decompressor for data produced by lz77.py, in sdasgb syntax for
+;; GBDK/SDCC projects. Declared in lz77.h as
+;;
+;;   unsigned char *lz77_decompress(unsigned char *dst, const unsigned char *src) __sdcccall(1);
+;;
+;; With __sdcccall(1) dst is passed in de and src in bc, and the end of the
+;; decompressed data is returned in bc. Destroys af, bc, de, hl.
+
+    .module lz77
+    .globl _lz77_decompress
+
+    .area _CODE
+
+_lz77_decompress::
+    ld h, b
+    ld l, c
+1$:                     ; command
+    ld a, (hl+)
+    or a, a
+    jr z, 5$            ; 0x00: end of stream
+    bit 7, a
+    jr nz, 3$
+
+    ld c, a             ; 0x01-0x7F: copy c literal bytes
+2$:
+    ld a, (hl+)
+    ld (de), a
+    inc de
+    dec c
+    jr nz, 2$
+    jr 1$
+
+3$:                     ; 0x80-0xFF: copy (a & 0x7F) + 4 bytes from de - distance
+    and a, #0x7F
+    add a, #4
+    ld c, a
+    ld a, (hl+)
+    ld b, a             ; distance low byte
+    ld a, (hl+)         ; distance high byte
+    push hl
+    ld h, a
+    ld a, e
+    sub a, b
+    ld l, a
+    ld a, d
+    sbc a, h
+    ld h, a
+4$:
+    ld a, (hl+)
+    ld (de), a
+    inc de
+    dec c
+    jr nz, 4$
+    pop hl
+    jr 1$
+
+5$:
+    ld b, d
+    ld c, e
+    ret
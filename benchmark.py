@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import png
+import cache
+import export
+import imgtogb
+import imgtosgb
+import lcd
+import profiler
+
+# Deterministic synthetic corpora. Each generator returns (data, colors) with
+# data a (height, width) array of indices into the RGBA colors.
+
+
+def gray_colors(n=4):
+    return [(255 - i * 85, 255 - i * 85, 255 - i * 85) for i in range(n)]
+
+
+def random_colors(rng, n):
+    return [tuple(int(v) for v in rng.integers(0, 256, 3)) for _ in range(n)]
+
+
+def assemble(pool, choice, tiles_x, tiles_y):
+    # lays out pool tiles, given as (N,8,8) arrays, in a tiles_x by tiles_y grid
+    tiles = pool[choice].reshape(tiles_y, tiles_x, 8, 8)
+    return tiles.transpose(0, 2, 1, 3).reshape(tiles_y * 8, tiles_x * 8)
+
+
+def gen_sprites(rng, width=128, height=128):
+    # sprite sheet with a transparent background and some empty tiles
+    data = rng.integers(0, 4, (height, width), dtype=np.uint8)
+    data[rng.random((height, width)) < 0.3] = 0
+    tiles_x, tiles_y = width // 8, height // 8
+    empty = rng.random((tiles_y, tiles_x)) < 0.2
+    data.reshape(tiles_y, 8, tiles_x, 8)[np.nonzero(empty)[0], :, np.nonzero(empty)[1], :] = 0
+    return data, gray_colors()
+
+
+def gen_map_reuse(rng, width=1024, height=1024, pool_size=96):
+    # large map built from a small set of tiles
+    pool = rng.integers(0, 4, (pool_size, 8, 8), dtype=np.uint8)
+    tiles_x, tiles_y = width // 8, height // 8
+    return assemble(pool, rng.integers(0, pool_size, tiles_x * tiles_y), tiles_x, tiles_y), gray_colors()
+
+
+def gen_map_noise(rng, width=512, height=512):
+    # every tile unique
+    return rng.integers(0, 4, (height, width), dtype=np.uint8), gray_colors()
+
+
+def gen_cgb_map(rng, width=512, height=512, palettes=8, pool_size=192):
+    # tiles each drawing from one of several 4 color palettes
+    colors = random_colors(rng, palettes * 4)
+    pool = rng.integers(0, 4, (pool_size, 8, 8), dtype=np.uint8)
+    pool += (4 * rng.integers(0, palettes, pool_size)).astype(np.uint8)[:, None, None]
+    tiles_x, tiles_y = width // 8, height // 8
+    return assemble(pool, rng.integers(0, pool_size, tiles_x * tiles_y), tiles_x, tiles_y), colors
+
+
+def gen_sgb_border(rng, width=256, height=224, palettes=3, pool_size=160):
+    # 16 color palettes sharing a transparent color 0
+    colors = [(0, 0, 0, 0)] + [c + (255,) for c in random_colors(rng, palettes * 15)]
+    pool = rng.integers(1, 16, (pool_size, 8, 8), dtype=np.uint8)
+    pool += (15 * rng.integers(0, palettes, pool_size)).astype(np.uint8)[:, None, None]
+    pool[rng.random((pool_size, 8, 8)) < 0.25] = 0
+    tiles_x, tiles_y = width // 8, height // 8
+    choice = rng.integers(0, pool_size, tiles_x * tiles_y)
+    # the center of a border is transparent
+    choice.reshape(tiles_y, tiles_x)[5:23, 6:26] = 0
+    pool[0] = 0
+    return assemble(pool, choice, tiles_x, tiles_y), colors
+
+
+# corpus name -> (generator, tool, command line options)
+CORPORA = {
+    "sprites": (gen_sprites, imgtogb, []),
+    "sprites_8x16": (gen_sprites, imgtogb, ["--s8x16"]),
+    "map_reuse": (gen_map_reuse, imgtogb, ["-m"]),
+    "map_noise": (gen_map_noise, imgtogb, ["-m"]),
+    "cgb_map": (gen_cgb_map, imgtogb, ["-m", "-c"]),
+    "sgb_border": (gen_sgb_border, imgtosgb, [])
+}
+
+
+def write_png(path, data, colors):
+    height, width = data.shape
+    writer = png.Writer(width, height, palette=colors, bitdepth=8)
+    with open(path, "wb") as f:
+        writer.write(f, data)
+
+
+def measure(tool, args, repeat):
+    # Runs the conversion of the tool repeat times recording the stages
+    # marked in the conversion code, keeping the best time of each, then
+    # once more under tracemalloc for the peak memory of each stage.
+    results = {}
+    for _ in range(repeat):
+        recorder = profiler.record(tool.convert_file, args)
+        times = {stage: s["time"] for stage, s in recorder.stages.items()}
+        times["total"] = recorder.total
+        for stage, t in times.items():
+            r = results.setdefault(stage, {"time": t})
+            r["time"] = min(r["time"], t)
+
+    recorder = profiler.record(tool.convert_file, args, trace=True)
+    for stage, s in recorder.stages.items():
+        results[stage]["peak"] = s["alloc"]
+    results["total"]["peak"] = max([s["alloc"] for s in recorder.stages.values()], default=0)
+    return results
+
+
+def run_benchmarks(names, repeat=3, seed=0):
+    workdir = tempfile.mkdtemp(prefix="imgtogb-bench-")
+    try:
+        corpora = {}
+        for name in names:
+            gen, tool, argv = CORPORA[name]
+            data, colors = gen(np.random.default_rng(seed))
+            path = os.path.join(workdir, name + ".png")
+            write_png(path, data, colors)
+            args = tool.build_parser().parse_args([path, os.path.join(workdir, name + ".h")] + argv)
+            results = measure(tool, args, repeat)
+            corpora[name] = {"width": data.shape[1], "height": data.shape[0], "stages": results}
+
+        # the LCD correction table is cached on disk, time building it once
+        start = time.perf_counter()
+        lcd.build_lcd_table()
+        lcd_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "version": cache.tool_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": seed,
+        "repeat": repeat,
+        "lcd_table": lcd_time,
+        "corpora": corpora
+    }
+
+
+def format_results(results, baseline=None):
+    lines = ["{:<14} {:<9} {:>10} {:>10}{}".format("corpus", "stage", "time", "peak", "    change" if baseline else "")]
+    for name, corpus in results["corpora"].items():
+        for stage, r in corpus["stages"].items():
+            line = "{:<14} {:<9} {:>8.2f}ms {:>8.0f}kB".format(name, stage, 1000 * r["time"], r["peak"] / 1024)
+            if baseline:
+                old = baseline["corpora"].get(name, {}).get("stages", {}).get(stage)
+                if old and old["time"] > 0:
+                    line += " {:>+8.1f}%".format(100 * (r["time"] / old["time"] - 1))
+            lines.append(line)
+    lines.append("lcd table build {:.2f}ms".format(1000 * results["lcd_table"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the conversion stages of the command line tools on synthetic images.")
+    parser.add_argument("corpora", help="Corpora to run. Defaults to all of: {}.".format(", ".join(CORPORA)), nargs="*")
+    parser.add_argument("-n", "--repeat", help="Runs per corpus. The best time of each stage is kept.", type=int, default=3)
+    parser.add_argument("-o", "--output", help="Write results as JSON to file.", type=str)
+    parser.add_argument("--compare", help="Print the change in time from an earlier JSON result file.", type=str)
+    parser.add_argument("--seed", help="Seed for the synthetic images.", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    names = args.corpora or list(CORPORA)
+    for name in names:
+        if name not in CORPORA:
+            raise ValueError("Unknown corpus \"{}\".".format(name))
+
+    results = run_benchmarks(names, args.repeat, args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    if args.output:
+        export.write_file(args.output, json.dumps(results, indent=2) + "\n")
+    print(format_results(results, baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import os
+import glob
+import json
+import shutil
+import hashlib
+import argparse
+import export
+
+
+DEFAULT_CACHE_SIZE = 256
+
+_tool_version = None
+
+
+def cache_dir():
+    path = os.environ.get("IMGTOGB_CACHE_DIR")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "imgtogb")
+    return path
+
+
+def tool_version():
+    # hash of the converter sources, so any change to the tools invalidates the cache
+    global _tool_version
+    if _tool_version is None:
+        h = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+            with open(path, "rb") as f:
+                h.update(f.read())
+        _tool_version = h.hexdigest()
+    return _tool_version
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_bytes(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class Cache:
+    # Conversion outputs stored under <dir>/objects/<key>/, where the key
+    # hashes the tool version, all options and the contents of all input
+    # images. Entries are evicted least recently used first once the total
+    # size exceeds max_size megabytes.
+    def __init__(self, path=None, max_size=DEFAULT_CACHE_SIZE):
+        self.path = path or cache_dir()
+        self.objects = os.path.join(self.path, "objects")
+        self.max_size = max_size * 1024 * 1024
+
+    def key(self, tool, options, inputs):
+        values = dict(vars(options))
+        for k in ("cache", "cache_size"):
+            values.pop(k, None)
+        for k in inputs:
+            if values.get(k):
+                values[k] = hash_file(values[k])
+
+        h = hashlib.sha256()
+        h.update(tool_version().encode())
+        h.update(tool.encode())
+        h.update(json.dumps(values, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def restore(self, key, outputs):
+        entry = os.path.join(self.objects, key)
+        if not os.path.isfile(os.path.join(entry, "complete")):
+            self.record(False)
+            return False
+
+        for role, path in outputs.items():
+            content = read_bytes(os.path.join(entry, role))
+            if content is None:
+                self.record(False)
+                return False
+            export.write_file(path, content)
+
+        os.utime(entry)
+        self.record(True)
+        return True
+
+    def store(self, key, outputs):
+        entry = os.path.join(self.objects, key)
+        tmp = "{}.{}.tmp".format(entry, os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        for role, path in outputs.items():
+            shutil.copyfile(path, os.path.join(tmp, role))
+        open(os.path.join(tmp, "complete"), "w").close()
+
+        try:
+            os.replace(tmp, entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+    def entries(self):
+        out = []
+        try:
+            names = os.listdir(self.objects)
+        except FileNotFoundError:
+            return out
+        for name in names:
+            entry = os.path.join(self.objects, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                out.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                pass
+        return out
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        for mtime, size, entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def record(self, hit):
+        # one byte per lookup; small O_APPEND writes do not interleave
+        # between concurrent processes
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "stats"), "ab") as f:
+            f.write(b"h" if hit else b"m")
+
+    def stats(self):
+        log = read_bytes(os.path.join(self.path, "stats")) or b""
+        entries = self.entries()
+        return {
+            "hits": log.count(b"h"),
+            "misses": log.count(b"m"),
+            "entries": len(entries),
+            "size": sum(e[1] for e in entries)
+        }
+
+    def clear(self):
+        shutil.rmtree(self.objects, ignore_errors=True)
+        try:
+            os.unlink(os.path.join(self.path, "stats"))
+        except FileNotFoundError:
+            pass
+
+
+def run_cached(tool, options, inputs, outputs, run):
+    # Runs run(options) unless the cache holds outputs for identical inputs.
+    # inputs and outputs list the option names holding input and output paths.
+    # Returns True on a cache hit.
+    outputs = {k: getattr(options, k) for k in outputs if getattr(options, k)}
+    if not getattr(options, "cache", False):
+        run(options)
+        return False
+
+    cache = Cache(max_size=options.cache_size)
+    key = cache.key(tool, options, inputs)
+    if cache.restore(key, outputs):
+        return True
+
+    run(options)
+    cache.store(key, outputs)
+    return False
+
+
+def add_arguments(parser):
+    parser.add_argument("--cache", help="Reuse outputs of earlier identical conversions from the cache.", action="store_true")
+    parser.add_argument("--cache_size", help="Maximum cache size in megabytes.", type=int, default=DEFAULT_CACHE_SIZE)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clear", help="Remove all cache entries and statistics.", action="store_true")
+    args = parser.parse_args()
+
+    cache = Cache()
+    if args.clear:
+        cache.clear()
+
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    print("Cache directory: {}".format(cache.path))
+    print("Entries: {} ({:.1f} kB)".format(stats["entries"], stats["size"] / 1024))
+    print("Hits: {}, misses: {}, hit rate: {:.1f}%".format(stats["hits"], stats["misses"], 100 * stats["hits"] / lookups if lookups else 0))
+
+
+if __name__ == "__main__":
+    main()
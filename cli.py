@@ -0,0 +1,35 @@
+import argparse
+
+
+def make_options(parser, **kwargs):
+    # Builds an options namespace holding the parser defaults, for calling the
+    # conversion functions without going through the command line.
+    options = parser.parse_args(["", ""])
+    options.infile, options.outfile = None, None
+    actions = {a.dest: a for a in parser._actions}
+    for k, v in kwargs.items():
+        if not hasattr(options, k):
+            raise TypeError("Unknown option \"{}\".".format(k))
+        if k in actions:
+            v = parse_value(actions[k], v)
+        setattr(options, k, v)
+    return options
+
+
+def parse_value(action, value):
+    # Applies the type and choices of the parser argument to values given as
+    # they would be on the command line, such as "16x16" for a size.
+    if isinstance(value, list):
+        return [parse_value(action, v) for v in value]
+
+    if action.type is None and action.nargs != 0 and isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    elif action.type is not None and isinstance(value, str):
+        try:
+            value = action.type(value)
+        except (ValueError, TypeError, argparse.ArgumentTypeError) as e:
+            raise ValueError("Invalid value \"{}\" for option \"{}\": {}".format(value, action.dest, e))
+
+    if action.choices is not None and value not in action.choices:
+        raise ValueError("Invalid value \"{}\" for option \"{}\", choose from {}.".format(value, action.dest, ", ".join(str(c) for c in action.choices)))
+    return value
@@ -0,0 +1,66 @@
+import time
+import numpy as np
+import rle
+import lz77
+
+
+# codec name -> (id written to headers, compress, decompress)
+CODECS = {
+    "rle": (1, rle.compress, rle.decompress),
+    "lz77": (2, lz77.compress, lz77.decompress)
+}
+
+CODEC_CHOICES = list(CODECS) + ["auto"]
+
+
+def codec_id(codec):
+    return CODECS[codec][0]
+
+
+def compress(data, codec="rle", verify=False, stats=None, name=None):
+    # Compresses data with the given codec, or with every codec keeping the
+    # smallest output for "auto". Appends the size and encode time of each
+    # attempt to stats if given. Returns the output and the codec used.
+    if codec == "auto":
+        candidates = list(CODECS)
+    elif codec in CODECS:
+        candidates = [codec]
+    else:
+        raise ValueError("Unknown codec \"{}\".".format(codec))
+
+    best, best_codec = None, None
+    for c in candidates:
+        start = time.perf_counter()
+        try:
+            out = CODECS[c][1](data)
+        except ValueError:
+            if codec != "auto":
+                raise
+            continue
+        elapsed = time.perf_counter() - start
+
+        if verify and not np.array_equal(CODECS[c][2](out), np.asarray(data)):
+            raise RuntimeError("{} compressed data does not decompress to the original.".format(c.upper()))
+
+        if stats is not None:
+            stats.append({
+                "name": name,
+                "codec": c,
+                "raw": len(data),
+                "compressed": len(out),
+                "ratio": len(out) / len(data) if len(data) else 1.0,
+                "time": elapsed
+            })
+
+        if best is None or len(out) < len(best):
+            best, best_codec = out, c
+
+    return best, best_codec
+
+
+def format_stats(stats):
+    lines = ["{:<24} {:<6} {:>8} {:>10} {:>7} {:>9}".format("array", "codec", "raw", "compressed", "ratio", "time")]
+    for s in stats:
+        lines.append("{:<24} {:<6} {:>8} {:>10} {:>6.1f}% {:>7.2f}ms".format(
+            s["name"] or "", s["codec"], s["raw"], s["compressed"], 100 * s["ratio"], 1000 * s["time"]))
+    return "\n".join(lines)
@@ -1,11 +1,173 @@
 import os
+import re
+import glob
 import math
+import numpy as np
 from string import Template
-from rle import compress as rle_compress
-
-
-def pretty_data(data, w=16):
-    return ",\n    ".join([", ".join(map(lambda x: str(x).rjust(3), data[i:i+w])) for i in range(0, len(data), w)])
+from itertools import chain
+import compression
+import animation
+import metasprite
+import profiler
+
+
+class ConversionResult:
+    def __init__(self, tile_data, tiles=None, tiles_width=0, tiles_height=0, palettes=None, palette_data=None, attributes=None, info=None):
+        self.tile_data = tile_data
+        self.tiles = tiles
+        self.tiles_width = tiles_width
+        self.tiles_height = tiles_height
+        self.palettes = palettes
+        self.palette_data = palette_data
+        self.attributes = attributes
+        self.info = info or {}
+
+
+def write_file(path, s):
+    # Leaves the file and its mtime untouched if the content is unchanged.
+    # Otherwise writes to a temporary file next to the target and renames it
+    # into place, so readers never see a partially written file.
+    mode = "b" if isinstance(s, bytes) else ""
+    try:
+        with open(path, "r" + mode) as f:
+            if f.read() == s:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp, "w" + mode) as f:
+            f.write(s)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return True
+
+
+def same_content(a, b, block_size=1 << 16):
+    try:
+        with open(a, "rb") as fa, open(b, "rb") as fb:
+            while True:
+                x, y = fa.read(block_size), fb.read(block_size)
+                if x != y:
+                    return False
+                if not x:
+                    return True
+    except OSError:
+        return False
+
+
+def write_stream(path, chunks):
+    # Like write_file, but writes an iterable of strings one piece at a time
+    # so the whole file is never held in memory.
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp, "w") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        if same_content(tmp, path):
+            os.unlink(tmp)
+            return False
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return True
+
+
+class Compressor:
+    # Compresses the arrays of one output file with the selected codec and
+    # remembers which codec was used for each array.
+    def __init__(self, codec="rle", verify=False, stats=None):
+        self.codec = codec
+        self.verify = verify
+        self.stats = stats
+        self.used = []
+
+    def __call__(self, name, data):
+        with profiler.stage("compress"):
+            out, used = compression.compress(data, self.codec, self.verify, self.stats, name)
+        self.used.append((name, used))
+        profiler.array(name, len(data), len(out), used)
+        return out
+
+    def defines(self):
+        # the default RLE-only output carries no codec defines
+        if self.codec == "rle":
+            return ""
+        return "".join("\n#define {}_codec {}U".format(n, compression.codec_id(c)) for n, c in self.used)
+
+
+class CArray:
+    # One named output array. kind selects the file extension in binary output.
+    def __init__(self, name, kind, data, ctype="unsigned char", width=16):
+        self.name = name
+        self.kind = kind
+        self.data = data
+        self.ctype = ctype
+        self.width = width
+
+    def iter_format(self, indent="    ", hexadecimal=False):
+        yield "const {} {}[] = {{\n{}".format(self.ctype, self.name, indent)
+        if len(self.data) == 0:
+            # C does not allow empty initializer lists
+            yield "0"
+        else:
+            yield from iter_pretty_data(self.data, self.width, hexadecimal)
+        yield "\n};"
+
+    def format(self, indent="    ", hexadecimal=False):
+        return "".join(self.iter_format(indent, hexadecimal))
+
+
+# formatted byte values, looked up instead of formatting every value
+DEC_TABLE = np.array([str(x).rjust(3) for x in range(256)], dtype=object)
+HEX_TABLE = np.array(["0x{:02X}".format(x) for x in range(256)], dtype=object)
+HEX_DIGITS = np.array(["{:02X}".format(x) for x in range(256)], dtype=object)
+
+# rows formatted at a time when streaming arrays
+EMIT_ROWS = 512
+
+
+def format_values(data, hexadecimal=False):
+    # Returns an object array with the formatted string of each value. Words
+    # in hex are combined from two byte lookups, words in decimal fall back
+    # to str.
+    data = np.asarray(data).astype(np.intp, copy=False)
+    if len(data) == 0 or (data.min() >= 0 and data.max() < 256):
+        return (HEX_TABLE if hexadecimal else DEC_TABLE)[data]
+    if hexadecimal:
+        return "0x" + HEX_DIGITS[(data >> 8) & 0xFF] + HEX_DIGITS[data & 0xFF]
+    return np.array([str(x).rjust(3) for x in data.tolist()], dtype=object)
+
+
+def iter_pretty_data(data, w=16, hexadecimal=False):
+    # Yields the output of pretty_data in pieces of EMIT_ROWS rows.
+    step = w * EMIT_ROWS
+    for start in range(0, len(data), step):
+        values = format_values(data[start:start+step], hexadecimal).tolist()
+        if start > 0:
+            yield ",\n    "
+        yield ",\n    ".join([", ".join(values[i:i+w]) for i in range(0, len(values), w)])
+
+
+def pretty_data(data, w=16, hexadecimal=False):
+    return "".join(iter_pretty_data(data, w, hexadecimal))
+
+
+def iter_arrays(arrays, indent="    ", hexadecimal=False, sep="\n", end=""):
+    # Yields arrays formatted as C definitions, separated by sep and
+    # followed by end if there are any.
+    for i, a in enumerate(arrays):
+        if i > 0:
+            yield sep
+        yield from a.iter_format(indent, hexadecimal)
+    if arrays:
+        yield end
 
 
 def split_data_parts(data, parts, chunk_size=16):
@@ -13,8 +175,18 @@ def split_data_parts(data, parts, chunk_size=16):
     return [data[(i*part_size) : ((i+1)*part_size)] for i in range(parts)]
 
 
-def gen_sprites_data(name, tile_data, palettes, palette_data, rle):
-    has_palettes = palettes != None
+def split_rows(data, parts, row_length):
+    # splits data into parts of whole rows as evenly as possible, putting the
+    # extra rows in the first parts
+    rows = len(data) // row_length
+    sizes = [rows // parts + (1 if i < rows % parts else 0) for i in range(parts)]
+    starts = np.cumsum([0] + sizes) * row_length
+    return [data[starts[i]:starts[i+1]] for i in range(parts)]
+
+
+def gen_sprites_arrays(name, tile_data, palettes, palette_data, rle, codec="rle", verify=False, stats=None):
+    has_palettes = palettes is not None
+    compress = Compressor(codec, verify, stats)
 
     tile_data_length = int(len(tile_data) / 16)
     palette_data_length = 0
@@ -22,12 +194,12 @@ def gen_sprites_data(name, tile_data, palettes, palette_data, rle):
         palette_data_length = int(len(palette_data) / 4)
 
     if rle:
-        tile_data = rle_compress(tile_data)
+        tile_data = compress(name + "_data", tile_data)
         if has_palettes:
-            palettes = rle_compress(palettes)
+            palettes = compress(name + "_palettes", palettes)
 
     pal_defs = ""
-    pal_data = ""
+    pal_arrays = []
 
     if has_palettes:
         pal_defs = Template("""#define ${name}_palette_data_length ${pdlen}U""").substitute(
@@ -35,62 +207,48 @@ def gen_sprites_data(name, tile_data, palettes, palette_data, rle):
             pdlen=palette_data_length
         )
 
-        pal_data = Template("""const unsigned int ${name}_palette_data[] = {
-    ${palette_data}
-};
-const unsigned char ${name}_palettes[] = {
-    ${palettes}
-};""").substitute(
-            name=name,
-            palette_data=pretty_data(palette_data, 4),
-            palettes=pretty_data(palettes)
-        )
+        pal_arrays.append(CArray(name + "_palette_data", "palette_data", palette_data, "unsigned int", 4))
+        pal_arrays.append(CArray(name + "_palettes", "palettes", palettes))
 
     spr_defs = Template("""#define ${name}_data_length ${datalength}U""").substitute(
         name=name,
         datalength=tile_data_length
-    )
+    ) + compress.defines()
 
-    spr_data = Template("""const unsigned char ${name}_data[] = {
-    ${data}
-};""").substitute(
-        name=name,
-        data=pretty_data(tile_data)
-    )
+    spr_arrays = [CArray(name + "_data", "data", tile_data)]
+
+    return spr_defs, spr_arrays, pal_defs, pal_arrays
+
+
+def gen_sprites_data(name, tile_data, palettes, palette_data, rle, codec="rle", verify=False, stats=None, hexadecimal=False):
+    spr_defs, spr_arrays, pal_defs, pal_arrays = gen_sprites_arrays(name, tile_data, palettes, palette_data, rle, codec, verify, stats)
+
+    spr_data = "".join(iter_arrays(spr_arrays, hexadecimal=hexadecimal))
+    pal_data = "".join(iter_arrays(pal_arrays, hexadecimal=hexadecimal))
 
     return spr_defs, spr_data, pal_defs, pal_data
 
 
-def write_sprites_c_header(path, tile_data, palettes=None, palette_data=None, rle=False):
+def write_sprites_c_header(path, tile_data, palettes=None, palette_data=None, rle=False, codec="rle", verify=False, stats=None, hexadecimal=False):
     name = os.path.splitext(os.path.basename(path))[0]
 
-    spr_defs, spr_data, pal_defs, pal_data = gen_sprites_data(name, tile_data, palettes, palette_data, rle)
-
-    s = Template("""#ifndef ${uname}_SPRITES_H
-#define ${uname}_SPRITES_H
-${spr_defs}
-${spr_data}
-${pal_defs}
-${pal_data}
-#endif
-""").substitute(
-        uname=name.upper(),
-        spr_defs=spr_defs,
-        spr_data=spr_data,
-        pal_defs=pal_defs,
-        pal_data=pal_data
-    )
+    spr_defs, spr_arrays, pal_defs, pal_arrays = gen_sprites_arrays(name, tile_data, palettes, palette_data, rle, codec, verify, stats)
 
-    with open(path, "w") as f:
-        f.write(s)
+    write_stream(path, chain(
+        ["#ifndef {0}_SPRITES_H\n#define {0}_SPRITES_H\n{1}\n".format(name.upper(), spr_defs)],
+        iter_arrays(spr_arrays, hexadecimal=hexadecimal),
+        ["\n{}\n".format(pal_defs)],
+        iter_arrays(pal_arrays, hexadecimal=hexadecimal),
+        ["\n#endif\n"]
+    ))
 
 
-def write_sprites_c_source(cpath, hpath, tile_data, palettes=None, palette_data=None, rle=False):
+def write_sprites_c_source(cpath, hpath, tile_data, palettes=None, palette_data=None, rle=False, codec="rle", verify=False, stats=None, hexadecimal=False):
     name = os.path.splitext(os.path.basename(hpath))[0]
 
-    spr_defs, spr_data, pal_defs, pal_data = gen_sprites_data(name, tile_data, palettes, palette_data, rle)
+    spr_defs, spr_arrays, pal_defs, pal_arrays = gen_sprites_arrays(name, tile_data, palettes, palette_data, rle, codec, verify, stats)
 
-    has_palettes = palettes != None
+    has_palettes = palettes is not None
 
     s_externs = "extern const unsigned char ${name}_data[];"
 
@@ -111,49 +269,64 @@ ${externs}
         externs=Template(s_externs).substitute(name=name)
     )
 
-    s_source = Template("""#include "${hpath}"
-${spr_data}
-${pal_data}
-""").substitute(
-        hpath=hpath,
-        spr_data=spr_data,
-        pal_data=pal_data
-    )
-
-    with open(cpath, "w") as f:
-        f.write(s_source)
+    write_stream(cpath, chain(
+        ["#include \"{}\"\n".format(hpath)],
+        iter_arrays(spr_arrays, hexadecimal=hexadecimal),
+        ["\n"],
+        iter_arrays(pal_arrays, hexadecimal=hexadecimal),
+        ["\n"]
+    ))
 
-    with open(hpath, "w") as f:
-        f.write(s_header)
+    write_file(hpath, s_header)
 
 
-def gen_map_data(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False):
-    has_palettes = palettes != None
+def gen_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, codec="rle", verify=False, stats=None, bank1_data=None):
+    # bank1_data holds the tiles placed in CGB VRAM bank 1, if any. The
+    # palette map may be left out when the attributes hold the palettes.
+    has_palettes = palettes is not None
+    has_palette_data = palette_data is not None
+    has_attributes = attributes is not None
+    compress = Compressor(codec, verify, stats)
 
     # split tile data
     tile_data = split_data_parts(tile_data, split_data, 16)
     tile_data_length = [int(len(d) / 16) for d in tile_data]
 
-    tiles = split_data_parts(tiles, split_tiles, 1)
-    tiles_height = math.floor(tiles_height / split_tiles)
-    
+    row_length = max(tiles_width, 1)
+    tiles = split_rows(tiles, split_tiles, row_length)
+    part_heights = [len(t) // row_length for t in tiles]
+    tiles_height = part_heights[0]
+
     palette_data_length = 0
     if has_palettes:
-        palettes = split_data_parts(palettes, split_tiles, 1)
+        palettes = split_rows(palettes, split_tiles, row_length)
+    if has_palette_data:
         palette_data_length = int(len(palette_data) / 4)
+    if has_attributes:
+        attributes = split_rows(attributes, split_tiles, row_length)
+
+    def part_name(array, i):
+        return "{}_{}{}".format(name, array, "" if i == 0 else i+1)
+
+    if bank1_data is not None:
+        bank1_data_length = len(bank1_data) // 16
 
     if rle_data:
-        tile_data = [rle_compress(d) for d in tile_data]
+        tile_data = [compress(part_name("data", i), d) for i, d in enumerate(tile_data)]
+        if bank1_data is not None:
+            bank1_data = compress(name + "_data_bank1", bank1_data)
 
     if rle_tiles:
-        tiles = [rle_compress(d) for d in tiles]
+        tiles = [compress(part_name("tiles", i), d) for i, d in enumerate(tiles)]
         if has_palettes:
-            palettes = [rle_compress(d) for d in palettes]
+            palettes = [compress(part_name("palettes", i), d) for i, d in enumerate(palettes)]
+        if has_attributes:
+            attributes = [compress(part_name("attributes", i), d) for i, d in enumerate(attributes)]
 
     pal_defs = ""
-    pal_data = ""
+    pal_arrays = []
 
-    if has_palettes:
+    if has_palette_data:
         pal_defs = Template("""#define ${name}_palette_data_length ${pdlen}U
 #define ${name}_palette_offset ${paloffset}U""").substitute(
             name=name,
@@ -161,17 +334,19 @@ def gen_map_data(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset
             paloffset=palette_offset
         )
 
-        pal_data = """const unsigned int {0}_palette_data[] = {{\n\t{1}\n}};\n""".format(name, pretty_data(palette_data, 4))
+        pal_arrays.append(CArray(name + "_palette_data", "palette_data", palette_data, "unsigned int", 4))
 
+    if has_palettes:
         for i in range(split_tiles):
-            id = "" if i == 0 else str(i+1)
-            pal_data += """const unsigned char {0}_palettes{1}[] = {{\n\t{2}\n}};\n""".format(name, id, pretty_data(palettes[i], 20))
+            pal_arrays.append(CArray(part_name("palettes", i), "palettes", palettes[i], width=20))
 
 
     map_defs = ""
     for i in range(split_data):
         id = "" if i == 0 else str(i+1)
         map_defs += "#define {0}_data_length{1} {2}U\n".format(name, id, tile_data_length[i])
+    if bank1_data is not None:
+        map_defs += "#define {0}_data_bank1_length {1}U\n".format(name, bank1_data_length)
 
     map_defs += Template("""#define ${name}_tiles_width ${width}U
 #define ${name}_tiles_height ${height}U
@@ -182,60 +357,71 @@ def gen_map_data(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset
         height=tiles_height,
         offset=tiles_offset
     )
+    for i in range(1, split_tiles):
+        if part_heights[i] != tiles_height:
+            map_defs += "\n#define {0}_tiles_height{1} {2}U".format(name, i+1, part_heights[i])
+    map_defs += compress.defines()
 
-    map_data = ""
+    map_arrays = []
     for i in range(split_data):
-        id = "" if i == 0 else str(i+1)
-        map_data += """const unsigned char {0}_data{1}[] = {{\n\t{2}\n}};\n""".format(name, id, pretty_data(tile_data[i]))
+        map_arrays.append(CArray(part_name("data", i), "data", tile_data[i]))
+    if bank1_data is not None:
+        map_arrays.append(CArray(name + "_data_bank1", "data", bank1_data))
 
     for i in range(split_tiles):
-        id = "" if i == 0 else str(i+1)
-        map_data += """const unsigned char {0}_tiles{1}[] = {{\n\t{2}\n}};\n""".format(name, id, pretty_data(tiles[i], 20))
+        map_arrays.append(CArray(part_name("tiles", i), "tiles", tiles[i], width=20))
+        if has_attributes:
+            map_arrays.append(CArray(part_name("attributes", i), "attributes", attributes[i], width=20))
+
+    return map_defs, map_arrays, pal_defs, pal_arrays
+
+
+def gen_map_data(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, codec="rle", verify=False, stats=None, hexadecimal=False, bank1_data=None):
+    map_defs, map_arrays, pal_defs, pal_arrays = gen_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data, split_tiles, palettes, palette_data, palette_offset, rle_data, rle_tiles, attributes, codec, verify, stats, bank1_data)
+
+    map_data = "".join(iter_arrays(map_arrays, "\t", hexadecimal, "\n", "\n"))
+    pal_data = "".join(iter_arrays(pal_arrays, "\t", hexadecimal, "\n", "\n"))
 
     return map_defs, map_data, pal_defs, pal_data
 
-def write_map_c_header(path, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False):
-    name = os.path.splitext(os.path.basename(path))[0]
 
-    map_defs, map_data, pal_defs, pal_data = gen_map_data(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data, split_tiles, palettes, palette_data, palette_offset, rle_data, rle_tiles)
+def write_map_c_header(path, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, codec="rle", verify=False, stats=None, hexadecimal=False, bank1_data=None):
+    name = os.path.splitext(os.path.basename(path))[0]
 
-    s = Template("""#ifndef ${uname}_MAP_H
-#define ${uname}_MAP_H
-${map_defs}
-${map_data}
-${pal_defs}
-${pal_data}
-#endif
-""").substitute(
-        uname=name.upper(),
-        map_defs=map_defs,
-        map_data=map_data,
-        pal_defs=pal_defs,
-        pal_data=pal_data
-    )
+    map_defs, map_arrays, pal_defs, pal_arrays = gen_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data, split_tiles, palettes, palette_data, palette_offset, rle_data, rle_tiles, attributes, codec, verify, stats, bank1_data)
 
-    with open(path, "w") as f:
-        f.write(s)
+    write_stream(path, chain(
+        ["#ifndef {0}_MAP_H\n#define {0}_MAP_H\n{1}\n".format(name.upper(), map_defs)],
+        iter_arrays(map_arrays, "\t", hexadecimal, "\n", "\n"),
+        ["\n{}\n".format(pal_defs)],
+        iter_arrays(pal_arrays, "\t", hexadecimal, "\n", "\n"),
+        ["\n#endif\n"]
+    ))
 
 
-def write_map_c_source(cpath, hpath, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False):
+def write_map_c_source(cpath, hpath, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, codec="rle", verify=False, stats=None, hexadecimal=False, bank1_data=None):
     name = os.path.splitext(os.path.basename(hpath))[0]
-    has_palettes = palettes != None
+    has_palettes = palettes is not None
+    has_attributes = attributes is not None
 
-    map_defs, map_data, pal_defs, pal_data = gen_map_data(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data, split_tiles, palettes, palette_data, palette_offset, rle_data, rle_tiles)
+    map_defs, map_arrays, pal_defs, pal_arrays = gen_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data, split_tiles, palettes, palette_data, palette_offset, rle_data, rle_tiles, attributes, codec, verify, stats, bank1_data)
 
     s_externs = ""
     for i in range(split_data):
         id = "" if i == 0 else str(i+1)
         s_externs += "extern const unsigned char ${{name}}_data{0}[];\n".format(id)
+    if bank1_data is not None:
+        s_externs += "extern const unsigned char ${name}_data_bank1[];\n"
 
     for i in range(split_tiles):
         id = "" if i == 0 else str(i+1)
         s_externs += "extern const unsigned char ${{name}}_tiles{0}[];\n".format(id)
         if has_palettes:
             s_externs += "extern const unsigned char ${{name}}_palettes{0}[];\n".format(id)
+        if has_attributes:
+            s_externs += "extern const unsigned char ${{name}}_attributes{0}[];\n".format(id)
 
-    if has_palettes:
+    if palette_data is not None:
         s_externs += "extern const unsigned int ${name}_palette_data[];\n"
 
     s_header = Template("""#ifndef ${uname}_MAP_H
@@ -251,23 +437,365 @@ ${externs}
         externs=Template(s_externs).substitute(name=name)
     )
 
-    s_source = Template("""#include "${hpath}"
-${map_data}
-${pal_data}
+    write_stream(cpath, chain(
+        ["#include \"{}\"\n".format(hpath)],
+        iter_arrays(map_arrays, "\t", hexadecimal, "\n", "\n"),
+        ["\n"],
+        iter_arrays(pal_arrays, "\t", hexadecimal, "\n", "\n"),
+        ["\n"]
+    ))
+
+    write_file(hpath, s_header)
+
+
+def write_tileset_c_header(path, tile_data, rle=False, codec="rle", verify=False, stats=None, hexadecimal=False):
+    name = os.path.splitext(os.path.basename(path))[0]
+    compress = Compressor(codec, verify, stats)
+
+    tile_data_length = len(tile_data) // 16
+    if rle:
+        tile_data = compress(name + "_data", tile_data)
+
+    write_stream(path, chain(
+        ["#ifndef {0}_TILESET_H\n#define {0}_TILESET_H\n#define {1}_data_length {2}U{3}\n".format(name.upper(), name, tile_data_length, compress.defines())],
+        CArray(name + "_data", "data", tile_data).iter_format("\t", hexadecimal),
+        ["\n#endif\n"]
+    ))
+
+
+def write_tilemap_c_header(path, tiles, tiles_width, tiles_height, tiles_offset, attributes=None, rle=False, codec="rle", verify=False, stats=None, hexadecimal=False):
+    # Tile map of an image whose tile data is in a shared tileset.
+    name = os.path.splitext(os.path.basename(path))[0]
+    compress = Compressor(codec, verify, stats)
+
+    arrays = [CArray(name + "_tiles", "tiles", tiles, width=20)]
+    if attributes is not None:
+        arrays.append(CArray(name + "_attributes", "attributes", attributes, width=20))
+    if rle:
+        for a in arrays:
+            a.data = compress(a.name, a.data)
+
+    map_defs = Template("""#define ${name}_tiles_width ${width}U
+#define ${name}_tiles_height ${height}U
+#define ${name}_tiles_offset ${offset}U""").substitute(
+        name=name,
+        width=tiles_width,
+        height=tiles_height,
+        offset=tiles_offset
+    ) + compress.defines()
+
+    write_stream(path, chain(
+        ["#ifndef {0}_MAP_H\n#define {0}_MAP_H\n{1}\n".format(name.upper(), map_defs)],
+        iter_arrays(arrays, "\t", hexadecimal, "\n", "\n"),
+        ["#endif\n"]
+    ))
+
+
+def split_chunks(data, tiles_width, tiles_height, chunk_width, chunk_height):
+    # Returns a (chunks, chunk_width * chunk_height) array holding the row-major
+    # map data of each chunk, with chunks in row-major order.
+    data = np.asarray(data).reshape(tiles_height // chunk_height, chunk_height, tiles_width // chunk_width, chunk_width)
+    return data.transpose(0, 2, 1, 3).reshape(-1, chunk_width * chunk_height)
+
+
+def gen_chunked_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, chunk_width, chunk_height, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, bank=1, bank_size=0x4000, codec="rle", verify=False, stats=None):
+    # Splits the tile map into chunks of chunk_width by chunk_height tiles.
+    # Each chunk is stored as its tile map followed by its attribute and
+    # palette maps if present, compressed as one stream with rle_tiles.
+    # Chunks are packed in order into arrays of at most bank_size bytes, one
+    # per ROM bank starting at bank. The chunk index holds the offset into
+    # its bank array (low byte first) and the bank number of each chunk.
+    if chunk_width <= 0 or chunk_height <= 0:
+        raise ValueError("Chunk size must be positive.")
+    if tiles_width % chunk_width != 0 or tiles_height % chunk_height != 0:
+        raise ValueError("Map size {}x{} not divisible by chunk size {}x{}.".format(tiles_width, tiles_height, chunk_width, chunk_height))
+
+    compress = Compressor(codec, verify, stats)
+
+    tile_data_length = len(tile_data) // 16
+    if rle_data:
+        tile_data = compress(name + "_data", tile_data)
+
+    parts = [tiles] + [a for a in (attributes, palettes) if a is not None]
+    chunks = np.hstack([split_chunks(a, tiles_width, tiles_height, chunk_width, chunk_height) for a in parts])
+
+    banks = [[]]
+    index = np.zeros((len(chunks), 3), np.intp)
+    offset = 0
+    for i, chunk in enumerate(chunks):
+        if rle_tiles:
+            chunk = compress("{}_chunk{}".format(name, i), chunk)
+        if len(chunk) > bank_size:
+            raise ValueError("Chunk {} takes {} bytes, more than a bank of {} bytes.".format(i, len(chunk), bank_size))
+        if offset + len(chunk) > bank_size:
+            banks.append([])
+            offset = 0
+        if bank + len(banks) - 1 > 255:
+            raise ValueError("Chunk data needs ROM banks {} to {} or more, bank numbers above 255 do not fit the chunk index.".format(bank, bank + len(banks) - 1))
+        index[i] = (offset & 0xFF, offset >> 8, bank + len(banks) - 1)
+        banks[-1].append(chunk)
+        offset += len(chunk)
+
+    map_defs = Template("""#define ${name}_data_length ${datalength}U
+#define ${name}_tiles_width ${width}U
+#define ${name}_tiles_height ${height}U
+#define ${name}_tiles_offset ${offset}U
+#define ${name}_chunk_width ${cwidth}U
+#define ${name}_chunk_height ${cheight}U
+#define ${name}_chunks_x ${chunksx}U
+#define ${name}_chunks_y ${chunksy}U
+#define ${name}_chunk_size ${chunksize}U
+#define ${name}_chunk_banks ${nbanks}U
+#define ${name}_chunk_bank ${bank}U""").substitute(
+        name=name,
+        datalength=tile_data_length,
+        width=tiles_width,
+        height=tiles_height,
+        offset=tiles_offset,
+        cwidth=chunk_width,
+        cheight=chunk_height,
+        chunksx=tiles_width // chunk_width,
+        chunksy=tiles_height // chunk_height,
+        chunksize=chunks.shape[1],
+        nbanks=len(banks),
+        bank=bank
+    ) + compress.defines()
+
+    arrays = [CArray(name + "_data", "data", tile_data), CArray(name + "_chunk_index", "chunk_index", index.reshape(-1), width=12)]
+    for i, b in enumerate(banks):
+        arrays.append(CArray("{}_chunks{}".format(name, bank + i), "chunks", np.concatenate(b), width=20))
+
+    pal_defs = ""
+    if palette_data is not None:
+        pal_defs = "#define {0}_palette_data_length {1}U\n#define {0}_palette_offset {2}U".format(name, len(palette_data) // 4, palette_offset)
+        arrays.append(CArray(name + "_palette_data", "palette_data", palette_data, "unsigned int", 4))
+
+    return map_defs, pal_defs, arrays
+
+
+def write_chunked_map_c_header(path, tile_data, tiles, tiles_width, tiles_height, tiles_offset, chunk_width, chunk_height, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, bank=1, bank_size=0x4000, codec="rle", verify=False, stats=None, hexadecimal=False):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    # The chunk array of each ROM bank goes to its own source file next to
+    # path, placed in its bank with #pragma bank, and is declared in the header.
+    map_defs, pal_defs, arrays = gen_chunked_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, chunk_width, chunk_height, palettes, palette_data, palette_offset, rle_data, rle_tiles, attributes, bank, bank_size, codec, verify, stats)
+    chunk_arrays = [a for a in arrays if a.kind == "chunks"]
+    arrays = [a for a in arrays if a.kind != "chunks"]
+
+    directory = os.path.dirname(path)
+    written = set()
+    for i, a in enumerate(chunk_arrays):
+        chunk_path = os.path.join(directory, a.name + ".c")
+        write_stream(chunk_path, chain(
+            ["#pragma bank {}\n\n".format(bank + i)],
+            a.iter_format("\t", hexadecimal),
+            ["\n"]
+        ))
+        written.add(os.path.normpath(chunk_path))
+    # remove chunk files of banks no longer used by the map
+    pattern = re.compile(re.escape(name) + r"_chunks\d+\.c")
+    for f in glob.glob(os.path.join(glob.escape(directory), glob.escape(name) + "_chunks*.c")):
+        if pattern.fullmatch(os.path.basename(f)) and os.path.normpath(f) not in written:
+            os.remove(f)
+    externs = "".join("extern const unsigned char {}[];\n".format(a.name) for a in chunk_arrays)
+
+    write_stream(path, chain(
+        ["#ifndef {0}_MAP_H\n#define {0}_MAP_H\n{1}\n{2}\n{3}".format(name.upper(), map_defs, pal_defs, externs)],
+        iter_arrays(arrays, "\t", hexadecimal, "\n", "\n"),
+        ["#endif\n"]
+    ))
+
+
+def write_chunked_map_binary(path, tile_data, tiles, tiles_width, tiles_height, tiles_offset, chunk_width, chunk_height, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, bank=1, bank_size=0x4000, codec="rle", verify=False, stats=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    map_defs, pal_defs, arrays = gen_chunked_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, chunk_width, chunk_height, palettes, palette_data, palette_offset, rle_data, rle_tiles, attributes, bank, bank_size, codec, verify, stats)
+
+    write_binary(path, name.upper() + "_MAP_H", [map_defs, pal_defs], arrays)
+
+
+def gen_metasprite_arrays(name, tile_data, frames, frame_width, frame_height, palette_data=None, rle=False, codec="rle", verify=False, stats=None):
+    compress = Compressor(codec, verify, stats)
+
+    tile_data_length = len(tile_data) // 16
+    if rle:
+        tile_data = compress(name + "_data", tile_data)
+
+    table = np.concatenate([np.append(np.asarray(f, np.intp).reshape(-1), metasprite.METASPRITE_END) for f in frames]) if frames else np.zeros(0, np.intp)
+    starts = np.cumsum([0] + [len(f) * 4 + 1 for f in frames[:-1]])
+
+    defs = Template("""#define ${name}_data_length ${datalength}U
+#define ${name}_frame_count ${count}U
+#define ${name}_frame_width ${width}U
+#define ${name}_frame_height ${height}U""").substitute(
+        name=name,
+        datalength=tile_data_length,
+        count=len(frames),
+        width=frame_width,
+        height=frame_height
+    ) + compress.defines()
+
+    arrays = [
+        CArray(name + "_data", "data", tile_data),
+        CArray(name + "_metasprites", "metasprites", table),
+        CArray(name + "_frames", "frames", starts, "unsigned int", 8)
+    ]
+
+    pal_defs = ""
+    if palette_data is not None:
+        pal_defs = "#define {}_palette_data_length {}U".format(name, len(palette_data) // 4)
+        arrays.append(CArray(name + "_palette_data", "palette_data", palette_data, "unsigned int", 4))
+
+    return defs, pal_defs, arrays
+
+
+def write_metasprites_c_header(path, tile_data, frames, frame_width, frame_height, palette_data=None, rle=False, codec="rle", verify=False, stats=None, hexadecimal=False):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    defs, pal_defs, arrays = gen_metasprite_arrays(name, tile_data, frames, frame_width, frame_height, palette_data, rle, codec, verify, stats)
+
+    write_stream(path, chain(
+        ["#ifndef {0}_METASPRITES_H\n#define {0}_METASPRITES_H\n{1}\n{2}\n".format(name.upper(), defs, pal_defs)],
+        iter_arrays(arrays, "    ", hexadecimal, "\n", "\n"),
+        ["#endif\n"]
+    ))
+
+
+def write_metasprites_binary(path, tile_data, frames, frame_width, frame_height, palette_data=None, rle=False, codec="rle", verify=False, stats=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    defs, pal_defs, arrays = gen_metasprite_arrays(name, tile_data, frames, frame_width, frame_height, palette_data, rle, codec, verify, stats)
+
+    write_binary(path, name.upper() + "_METASPRITES_H", [defs, pal_defs], arrays)
+
+
+def gen_animation_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, slot_count, tile_patches, tile_bounds, map_patches, map_bounds, rle_data=False, rle_tiles=False, codec="rle", verify=False, stats=None):
+    # Patches are left uncompressed so they can be copied straight to VRAM.
+    # The patch indices hold the byte offset of the patches of each frame,
+    # followed by the total size.
+    compress = Compressor(codec, verify, stats)
+
+    tile_data_length = len(tile_data) // 16
+    if rle_data:
+        tile_data = compress(name + "_data", tile_data)
+    if rle_tiles:
+        tiles = compress(name + "_tiles", tiles)
+
+    defs = Template("""#define ${name}_data_length ${datalength}U
+#define ${name}_slot_count ${slots}U
+#define ${name}_frame_count ${count}U
+#define ${name}_tiles_width ${width}U
+#define ${name}_tiles_height ${height}U
+#define ${name}_tiles_offset ${offset}U""").substitute(
+        name=name,
+        datalength=tile_data_length,
+        slots=slot_count,
+        count=len(tile_bounds) - 1,
+        width=tiles_width,
+        height=tiles_height,
+        offset=tiles_offset
+    ) + compress.defines()
+
+    arrays = [
+        CArray(name + "_data", "data", tile_data),
+        CArray(name + "_tiles", "tiles", tiles, width=20),
+        CArray(name + "_tile_patches", "tile_patches", np.asarray(tile_patches).reshape(-1), width=animation.TILE_PATCH_SIZE),
+        CArray(name + "_tile_patch_index", "patch_index", np.asarray(tile_bounds) * animation.TILE_PATCH_SIZE, "unsigned int", 8),
+        CArray(name + "_map_patches", "map_patches", np.asarray(map_patches).reshape(-1), width=animation.MAP_PATCH_SIZE * 6),
+        CArray(name + "_map_patch_index", "patch_index", np.asarray(map_bounds) * animation.MAP_PATCH_SIZE, "unsigned int", 8)
+    ]
+    return defs, arrays
+
+
+def write_animation_c_header(path, tile_data, tiles, tiles_width, tiles_height, tiles_offset, slot_count, tile_patches, tile_bounds, map_patches, map_bounds, rle_data=False, rle_tiles=False, codec="rle", verify=False, stats=None, hexadecimal=False):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    defs, arrays = gen_animation_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, slot_count, tile_patches, tile_bounds, map_patches, map_bounds, rle_data, rle_tiles, codec, verify, stats)
+
+    write_stream(path, chain(
+        ["#ifndef {0}_ANIMATION_H\n#define {0}_ANIMATION_H\n{1}\n".format(name.upper(), defs)],
+        iter_arrays(arrays, "\t", hexadecimal, "\n", "\n"),
+        ["#endif\n"]
+    ))
+
+
+def write_animation_binary(path, tile_data, tiles, tiles_width, tiles_height, tiles_offset, slot_count, tile_patches, tile_bounds, map_patches, map_bounds, rle_data=False, rle_tiles=False, codec="rle", verify=False, stats=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    defs, arrays = gen_animation_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, slot_count, tile_patches, tile_bounds, map_patches, map_bounds, rle_data, rle_tiles, codec, verify, stats)
+
+    write_binary(path, name.upper() + "_ANIMATION_H", [defs], arrays)
+
+
+BINARY_EXTENSIONS = {
+    "tile_patches": "tilepatch",
+    "map_patches": "mappatch",
+    "patch_index": "patchidx",
+    "metasprites": "metasprite",
+    "frames": "frames",
+    "chunk_index": "chunkidx",
+    "chunks": "chunks",
+    "data": "2bpp",
+    "tiles": "tilemap",
+    "attributes": "attrmap",
+    "palettes": "palmap",
+    "palette_data": "pal"
+}
+
+
+def array_bytes(array):
+    # unsigned int arrays are stored as little endian 16-bit words
+    data = np.asarray(array.data)
+    if array.ctype == "unsigned int":
+        if len(data) > 0 and (data.min() < 0 or data.max() > 0xFFFF):
+            raise ValueError("Array \"{}\" does not fit in 16-bit words.".format(array.name))
+        return data.astype("<u2").tobytes()
+    if len(data) > 0 and (data.min() < 0 or data.max() > 255):
+        raise ValueError("Array \"{}\" does not fit in bytes.".format(array.name))
+    return data.astype(np.uint8).tobytes()
+
+
+def write_binary(path, guard, defs, arrays):
+    # Writes each array to its own file next to path and a header with only
+    # the defines and the size of each file.
+    directory = os.path.dirname(path)
+    sizes = ""
+    for a in arrays:
+        data = array_bytes(a)
+        write_file(os.path.join(directory, "{}.{}".format(a.name, BINARY_EXTENSIONS[a.kind])), data)
+        sizes += "#define {}_size {}U\n".format(a.name, len(data))
+
+    s = Template("""#ifndef ${guard}
+#define ${guard}
+${defs}
+${sizes}
+#endif
 """).substitute(
-        hpath=hpath,
-        map_data=map_data,
-        pal_data=pal_data
+        guard=guard,
+        defs="\n".join(d for d in defs if d),
+        sizes=sizes
     )
 
-    with open(cpath, "w") as f:
-        f.write(s_source)
+    write_file(path, s)
 
-    with open(hpath, "w") as f:
-        f.write(s_header)
 
+def write_sprites_binary(path, tile_data, palettes=None, palette_data=None, rle=False, codec="rle", verify=False, stats=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    spr_defs, spr_arrays, pal_defs, pal_arrays = gen_sprites_arrays(name, tile_data, palettes, palette_data, rle, codec, verify, stats)
+
+    write_binary(path, name.upper() + "_SPRITES_H", [spr_defs, pal_defs], spr_arrays + pal_arrays)
 
-def write_border_c_header(path, tile_data, tiles, palettes, palette_data, rle=False):
+
+def write_map_binary(path, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data=1, split_tiles=1, palettes=None, palette_data=None, palette_offset=None, rle_data=False, rle_tiles=False, attributes=None, codec="rle", verify=False, stats=None, bank1_data=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    map_defs, map_arrays, pal_defs, pal_arrays = gen_map_arrays(name, tile_data, tiles, tiles_width, tiles_height, tiles_offset, split_data, split_tiles, palettes, palette_data, palette_offset, rle_data, rle_tiles, attributes, codec, verify, stats, bank1_data)
+
+    write_binary(path, name.upper() + "_MAP_H", [map_defs, pal_defs], map_arrays + pal_arrays)
+
+
+def write_border_c_header(path, tile_data, tiles, palettes, palette_data, rle=False, codec="rle", verify=False, stats=None):
     name = os.path.splitext(os.path.basename(path))[0]
 
     tile_data_length = len(tile_data) // 32
@@ -276,15 +804,16 @@ def write_border_c_header(path, tile_data, tiles, palettes, palette_data, rle=Fa
     tile_data1 = tile_data[0:0x1000]
     tile_data2 = tile_data[0x1000:0x2000]
 
+    compress = Compressor(codec, verify, stats)
     if rle:
-        tile_data1 = rle_compress(tile_data1)
-        tile_data2 = rle_compress(tile_data2)
-        tiles = rle_compress(tiles)
-        palettes = rle_compress(palettes)
+        tile_data1 = compress(name + "_data1", tile_data1)
+        tile_data2 = compress(name + "_data2", tile_data2)
+        tiles = compress(name + "_tiles", tiles)
+        palettes = compress(name + "_palettes", palettes)
 
     s = Template("""#ifndef ${uname}_BORDER_H
 #define ${uname}_BORDER_H
-#define ${name}_data_length ${datalength}U
+#define ${name}_data_length ${datalength}U${codecs}
 const unsigned char ${name}_data1[] = {
     ${data1}
 };
@@ -306,6 +835,7 @@ const unsigned int ${name}_palette_data[] = {
         uname=name.upper(),
         name=name,
         datalength=tile_data_length,
+        codecs=compress.defines(),
         data1=pretty_data(tile_data1),
         data2=pretty_data(tile_data2),
         tiles=pretty_data(tiles, 32),
@@ -314,5 +844,38 @@ const unsigned int ${name}_palette_data[] = {
         palettedata=pretty_data(palette_data)
     )
 
-    with open(path, "w") as f:
-        f.write(s)
+    write_file(path, s)
+
+
+def write_palette_c_header(path, palette_data, as_bytes=False):
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    datatype = "int"
+    pdlen = len(palette_data) // 4
+
+    if as_bytes:
+        datatype = "char"
+        out = []
+        for x in palette_data:
+            out.append(x & 0xFF)
+            out.append(x >> 8)
+        palette_data = out
+
+    s = Template("""#ifndef ${uname}_PALETTE_H
+#define ${uname}_PALETTE_H
+
+#define ${name}_palette_data_length ${pdlen}U
+const unsigned ${datatype} ${name}_palette_data[] = {
+    ${data}
+};
+
+#endif
+""").substitute(
+        name=name,
+        uname=name.upper(),
+        pdlen=pdlen,
+        datatype=datatype,
+        data=pretty_data(palette_data, 4)
+    )
+
+    write_file(path, s)
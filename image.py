@@ -0,0 +1,41 @@
+import png
+import numpy as np
+
+
+def row_dtype(meta):
+    return np.uint16 if meta["bitdepth"] > 8 else np.uint8
+
+
+def read_png(path):
+    # Returns the image as a (height, width * planes) array together with the
+    # PNG metadata. Rows are decoded straight into a preallocated array.
+    source = png.Reader(path)
+    width, height, data_map, meta = source.read()
+
+    data = np.empty((height, width * meta["planes"]), row_dtype(meta))
+    for y, row in enumerate(data_map):
+        data[y] = np.frombuffer(row, data.dtype)
+
+    return data, meta
+
+
+def iter_bands(data_map, row_length, dtype, band_height):
+    band = np.empty((band_height, row_length), dtype)
+    n = 0
+    for row in data_map:
+        band[n] = np.frombuffer(row, dtype)
+        n += 1
+        if n == band_height:
+            yield band
+            n = 0
+    if n > 0:
+        yield band[:n]
+
+
+def read_png_bands(path, band_height=8):
+    # Like read_png, but returns an iterator over bands of band_height rows
+    # decoded on demand. The same buffer is reused for every band.
+    source = png.Reader(path)
+    width, height, data_map, meta = source.read()
+    bands = iter_bands(data_map, width * meta["planes"], row_dtype(meta), band_height)
+    return width, height, meta, bands
@@ -1,153 +1,196 @@
 #!/usr/bin/env python3
 import math
 import argparse
-import png
 import numpy as np
-import itertools
+import cache
+import cli
+import compression
 import export
+import image
+import incremental
+import tiledata
 import lcd
+import metasprite
+import packing
+import profiler
+import vram
 from colors import rgb_to_5bit
 from string import Template
 
 
-def convert_tile(data, x, y):
-    px, py = x*8, y*8
-    td = data[px:px+8, py:py+8]
+def make_color_palettes(data, colors, palette_map, tiles_x, tiles_y, packing_mode="greedy", time_budget=1.0):
+    td = tiledata.get_tiles(data, tiles_x, tiles_y)
+    return make_tile_palettes(td, len(colors), palette_map, tiles_x, packing_mode, time_budget)
 
-    out = []
-    for iy in range(8):
-        b0, b1 = 0, 0
-        for ix in range(8):
-            v = td[ix, iy]
 
-            b0 |= (v & 1) << (7 - ix)
-            b1 |= ((v & 2) >> 1) << (7 - ix)
+def make_tile_palettes(td, ncolors, palette_map, tiles_x, packing_mode="greedy", time_budget=1.0, positions=None):
+    # Assigns (N, 8, 8) tiles to palettes, extending palette_map. positions
+    # holds the row-major index of each tile in the image, for errors.
+    masks, counts = tiledata.color_masks(td, ncolors)
 
-        out.append(b0)
-        out.append(b1)
-    return tuple(out)
+    over = np.flatnonzero(counts > 4)
+    if len(over) > 0:
+        pos = over[0] if positions is None else positions[over[0]]
+        raise ValueError("Tile ({},{}) contains more than 4 different colors.".format(pos % tiles_x, pos // tiles_x))
 
+    if packing_mode == "optimal":
+        return packing.pack(masks, 4, palette_map, time_budget)
 
-def convert_tile_color(data, palette, x, y):
-    m = {}
-    for i in range(len(palette)):
-        m[palette[i]] = i
-
-    px, py = x*8, y*8
-    td = data[px:px+8, py:py+8]
-
-    out = []
-    for iy in range(8):
-        b0, b1 = 0, 0
-        for ix in range(8):
-            v = m[td[ix, iy]]
-
-            b0 |= (v & 1) << (7 - ix)
-            b1 |= ((v & 2) >> 1) << (7 - ix)
-
-        out.append(b0)
-        out.append(b1)
-    return tuple(out)
+    palette_masks = [sum(1 << int(v) for v in set(m)) for m in palette_map]
 
-
-def make_color_palettes(data, colors, palette_map, tiles_x, tiles_y):
+    # tiles with identical color sets always end up in the same palette, as
+    # palettes only grow and earlier palettes can never start fitting
+    memo = {}
     palettes = []
-    for y in range(tiles_y):
-        for x in range(tiles_x):
-            px, py = x*8, y*8
-            td = data[px:px+8, py:py+8]
-            values = np.unique(td)
-            if len(values) > 4:
-                raise ValueError("Tile ({},{}) contains more than 4 different colors.".format(x, y))
-
+    for mask, count in zip(masks, counts):
+        index = memo.get(mask)
+        if index is None:
             index = -1
             for i in range(len(palette_map)):
-                noverlap = sum(v in palette_map[i] for v in values)
-                if len(palette_map[i]) + len(values) - noverlap <= 4:
+                noverlap = (palette_masks[i] & mask).bit_count()
+                if len(palette_map[i]) + count - noverlap <= 4:
                     index = i
                     break
 
             if index == -1:
                 index = len(palette_map)
                 palette_map.append([])
+                palette_masks.append(0)
 
-            for v in values:
-                if v not in palette_map[index]:
-                    palette_map[index].append(v)
+            palette_map[index].extend(tiledata.mask_colors(mask & ~palette_masks[index]))
+            palette_masks[index] |= mask
+            memo[mask] = index
 
-            palettes.append(index)
+        palettes.append(index)
 
     return palettes, palette_map
 
 
-def read_palette_image(path, colors):
-    source = png.Reader(path)
-    width, height, data_map, meta = source.read()
+def make_palette_data(palette_map, colors):
+    palette_data = []
+    for m in palette_map:
+        for i in range(4):
+            if i < len(m):
+                palette_data.append(rgb_to_5bit(*colors[m[i]]))
+            else:
+                palette_data.append(0)
+    return palette_data
+
+
+def merge_palette_image(data, palette, colors):
     palette_map = []
 
-    if width != 4:
+    if data.shape[1] != 4:
         raise ValueError("Palette image must be 4 pixels wide.")
-    if "palette" not in meta:
-        raise ValueError("Palette image must be indexed.")
-
-    data = np.array(list(data_map)).transpose()
 
     # remap colors
     color_map = {}
-    for i in range(len(meta["palette"])):
-        c = meta["palette"][i]
+    for i in range(len(palette)):
+        c = palette[i]
         if c in colors:
             color_map[i] = colors.index(c)
         else:
             color_map[i] = len(colors)
             colors.append(c)
 
-    for iy in range(height):
-        x = list(color_map[i] for i in data[:,iy])
+    for row in data:
+        x = list(color_map[i] for i in row)
         palette_map.append(x)
 
     return colors, palette_map
 
 
-def make_dx_palettes(data, data_dx, colors, tiles_x, tiles_y):
-    palette_map = []
-    palettes = []
+def read_palette_image(path):
+    data, meta = image.read_png(path)
 
-    for y in range(tiles_y):
-        for x in range(tiles_x):
-            px, py = x*8, y*8
-            td = data[px:px+8, py:py+8]
-            td_dx = data_dx[px:px+8, py:py+8]
+    if data.shape[1] != 4:
+        raise ValueError("Palette image must be 4 pixels wide.")
+    if "palette" not in meta:
+        raise ValueError("Palette image must be indexed.")
 
-            pal = {}
+    return data, meta["palette"]
 
-            for ndi, ndv in zip(np.nditer(td), np.nditer(td_dx)):
-                i = ndi.item(0)
-                v = ndv.item(0)
-                if i in pal:
-                    if pal[i] != v:
-                        raise ValueError("Overloaded colors in tile ({},{}).".format(x, y))
-                else:
-                    pal[i] = v
 
-            index = -1
-            for i in range(len(palette_map)):
-                if all(k not in pal or pal[k] == v for k, v in palette_map[i].items()):
-                    index = i
-                    break
+def read_priority_mask(path):
+    # Returns a (height, width) array, true where the palette index or color
+    # is not zero. Alpha is ignored except that fully transparent pixels are
+    # never set.
+    data, meta = image.read_png(path)
+    data = data.reshape(data.shape[0], -1, meta["planes"])
+    if meta.get("alpha"):
+        return data[:, :, :-1].any(axis=2) & (data[:, :, -1] > 0)
+    return data.any(axis=2)
 
-            if index == -1:
-                index = len(palette_map)
-                palette_map.append(pal)
 
-            for k,v in pal.items():
-                palette_map[index][k] = v
-            palettes.append(index)
+def pack_attributes(result, priority=None):
+    # Packs the palette, VRAM bank and flip bits of each map entry into CGB
+    # BG attribute bytes, replacing the palette map. Tiles with any pixel set
+    # in the (height, width) priority mask get the priority bit.
+    palettes = np.asarray(result.palettes)
+    if len(palettes) > 0 and palettes.max() > 7:
+        raise ValueError("Attribute maps hold palettes 0 to 7, the map uses palette {}.".format(palettes.max()))
+
+    attributes = palettes.astype(np.uint8)
+    if result.attributes is not None:
+        attributes |= result.attributes
+
+    if priority is not None:
+        tiles_x, tiles_y = result.tiles_width, result.tiles_height
+        priority = np.asarray(priority)
+        if priority.shape != (tiles_y * 8, tiles_x * 8):
+            raise ValueError("Dimension of priority mask does not match input.")
+        tiles = priority.reshape(tiles_y, 8, tiles_x, 8).any(axis=(1, 3)).reshape(-1)
+        attributes |= tiles * np.uint8(tiledata.PRIORITY)
+
+    return export.ConversionResult(result.tile_data, result.tiles, result.tiles_width, result.tiles_height, None, result.palette_data, attributes, result.info)
+
+
+def make_dx_palettes(data, data_dx, colors, tiles_x, tiles_y):
+    td = tiledata.get_tiles(data, tiles_x, tiles_y).reshape(tiles_x * tiles_y, 64).astype(np.intp)
+    td_dx = tiledata.get_tiles(data_dx, tiles_x, tiles_y).reshape(tiles_x * tiles_y, 64).astype(np.intp)
+
+    # signature of each tile: the reference color of each DMG color, or -1
+    # if the tile doesn't use it
+    ncolors = max(4, int(td.max()) + 1) if td.size else 4
+    signatures = np.full((len(td), ncolors), -1, np.intp)
+    overloaded = np.zeros(len(td), bool)
+    for i in range(ncolors):
+        used = td == i
+        low = np.where(used, td_dx, np.iinfo(np.intp).max).min(axis=1)
+        high = np.where(used, td_dx, -1).max(axis=1)
+        present = used.any(axis=1)
+        overloaded |= present & (low != high)
+        signatures[present, i] = low[present]
+
+    over = np.flatnonzero(overloaded)
+    if len(over) > 0:
+        raise ValueError("Overloaded colors in tile ({},{}).".format(over[0] % tiles_x, over[0] // tiles_x))
+
+    # Tiles with identical signatures always end up in the same palette, as
+    # palettes only gain colors, so only distinct signatures are placed, in
+    # order of first appearance.
+    unique, first, inverse = np.unique(signatures, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    palette_map = np.zeros((0, ncolors), np.intp)
+    unique_palettes = np.zeros(len(unique), np.intp)
+    for u in order:
+        sig = unique[u]
+        fits = ((palette_map == -1) | (sig == -1) | (palette_map == sig)).all(axis=1)
+        index = np.flatnonzero(fits)
+        if len(index) > 0:
+            index = index[0]
+        else:
+            index = len(palette_map)
+            palette_map = np.vstack((palette_map, np.full(ncolors, -1, np.intp)))
+        palette_map[index] = np.where(sig != -1, sig, palette_map[index])
+        unique_palettes[u] = index
+
+    palettes = unique_palettes[inverse.reshape(-1)].tolist()
 
     palette_data = []
     for m in palette_map:
         for i in range(4):
-            if i in m:
+            if m[i] != -1:
                 palette_data.append(rgb_to_5bit(*colors[m[i]]))
             else:
                 palette_data.append(0)
@@ -155,7 +198,15 @@ def make_dx_palettes(data, data_dx, colors, tiles_x, tiles_y):
     return palettes, palette_data
 
 
-def main():
+def dimensions(s):
+    try:
+        w, h = s.lower().split("x")
+        return int(w), int(h)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Size must be given as WxH.")
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("infile", help="Image file.", type=str)
     parser.add_argument("outfile", help="Output file.", type=str)
@@ -164,122 +215,567 @@ def main():
     parser.add_argument("-d", "--dx", help="Color mode reference. Produces DMG and CGB compatible data for \"DX\"-style games.", type=str)
     parser.add_argument("-m", "--map", help="Produce tile map.", action="store_true")
     parser.add_argument("--s8x16", help="Enable 8x16 sprite mode.", action="store_true")
-    parser.add_argument("-r", "--rle", help="Compress data and tile map using RLE.", action="store_true")
-    parser.add_argument("-R", "--rle_data", help="Compress data using RLE.", action="store_true")
-    parser.add_argument("-T", "--rle_tiles", help="Compress tile map using RLE.", action="store_true")
+    parser.add_argument("-r", "--rle", help="Compress data and tile map.", action="store_true")
+    parser.add_argument("-R", "--rle_data", help="Compress data.", action="store_true")
+    parser.add_argument("-T", "--rle_tiles", help="Compress tile map.", action="store_true")
+    parser.add_argument("--codec", help="Compression codec. \"auto\" picks the smallest output for each array.", choices=compression.CODEC_CHOICES, default="rle")
+    parser.add_argument("--codec_stats", help="Print compression ratio and encode time of each compressed array.", action="store_true")
     parser.add_argument("-O", "--offset", help="Tile map offset.", type=int, default=0)
     parser.add_argument("-P", "--palette_offset", help="Palette index offset.", type=int, default=0)
     parser.add_argument("-I", "--include_palette", help="Force inclusion of palettes from image.", type=str)
     parser.add_argument("-s", "--split_data", help="Split tile data into multiple parts.", type=int, default=1)
     parser.add_argument("-S", "--split_tiles", help="Split tile map into multiple parts.", type=int, default=1)
+    parser.add_argument("--metasprite", help="Slice the sprite sheet into frames of WxH pixels and write a metasprite table per frame. Empty sprites are dropped and duplicates shared between frames.", type=dimensions)
+    parser.add_argument("--chunks", help="Split the tile map into chunks of WxH tiles with an index table of chunk offsets and banks, e.g. 32x32.", type=dimensions)
+    parser.add_argument("--bank", help="First ROM bank of chunk data.", type=int, default=1)
+    parser.add_argument("--bank_size", help="Maximum bytes of chunk data per ROM bank.", type=int, default=0x4000)
+    parser.add_argument("--vram", help="Place map tiles in VRAM for the LCDC tile addressing mode, starting at tile --offset, which is signed in 8800 mode. Fails if the tiles do not fit. In color mode tiles that do not fit in bank 0 go to bank 1, marked in the attribute map.", choices=sorted(vram.MODES))
+    parser.add_argument("--vram_budget", help="Maximum number of map tiles per VRAM bank.", type=int)
+    parser.add_argument("--attribute_map", help="Write the palette, VRAM bank, flip and priority bits of each map entry as one CGB BG attribute map in place of the palette map.", action="store_true")
+    parser.add_argument("--priority", help="Priority mask image for the attribute map. Tiles with any pixel of non-zero palette index or non-black color are drawn over sprites. Alpha is ignored, but fully transparent pixels are never set.", type=str)
     parser.add_argument("-l", "--correct_lcd", help="Correct colors for GBC LCD.", action="store_true")
-    args = parser.parse_args()
+    parser.add_argument("-f", "--flip", help="Match flipped tiles in tile map. Flip bits are written to an attribute map.", action="store_true")
+    parser.add_argument("--format", help="Output format. \"bin\" writes each array to a raw binary file next to outfile and only defines to the header.", choices=["c", "bin"], default="c")
+    parser.add_argument("--hex", help="Write array values in hexadecimal.", action="store_true")
+    parser.add_argument("--incremental", help="Keep the state of the conversion in a file next to outfile and only convert changed tiles on the next run. Tile indices of unchanged tiles are kept.", action="store_true")
+    parser.add_argument("--verify", help="Check that compressed arrays decompress to the original data.", action="store_true")
+    parser.add_argument("--packing", help="Palette packing engine. \"optimal\" searches for a packing with fewer palettes than the greedy first-fit.", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--packing_time", help="Time budget in seconds for optimal palette packing.", type=float, default=1.0)
+    cache.add_arguments(parser)
+    profiler.add_arguments(parser)
+    return parser
+
+
+def make_options(**kwargs):
+    return cli.make_options(build_parser(), **kwargs)
 
-    source = png.Reader(args.infile)
-    width, height, data_map, meta = source.read()
 
+def check_options(width, height, colors, options):
     if width % 8 != 0 or height % 8 != 0:
         raise ValueError("Image dimensions not divisible by 8.")
-    if "palette" not in meta:
-        raise ValueError("PNG image is not indexed.")
-    if not args.color and len(meta["palette"]) > 4:
+    if not options.color and len(colors) > 4:
         raise ValueError("At most 4 colors are supported in non-color mode.")
-    if args.split_data < 1:
+    if options.split_data < 1:
         raise ValueError("Tile data split must be 1 or more parts.")
-    if args.split_data > 1 and not args.map:
+    if options.split_data > 1 and not options.map:
         raise ValueError("Tile data split not implemented for sprite output yet.")
-    if args.split_tiles < 1:
+    if options.split_tiles < 1:
         raise ValueError("Tile map split must be 1 or more parts.")
+    if options.flip and not (options.map and options.color) and not options.metasprite:
+        raise ValueError("Flipped tile matching requires color and map mode, or metasprite mode.")
+    if options.metasprite and options.map:
+        raise ValueError("Metasprite mode can not be combined with map mode.")
+    if options.metasprite and options.s8x16 and options.offset % 2 != 0:
+        raise ValueError("Metasprite tile offset must be even in 8x16 mode.")
+    if options.chunks and not options.map:
+        raise ValueError("Chunked export requires map mode.")
+    if options.chunks and (options.split_data > 1 or options.split_tiles > 1 or options.s8x16):
+        raise ValueError("Chunked export can not be combined with split data or 8x16 mode.")
+    if options.vram and not options.map:
+        raise ValueError("VRAM allocation requires map mode.")
+    if options.vram and (options.chunks or options.split_data > 1):
+        raise ValueError("VRAM allocation can not be combined with chunked export or split data.")
+    if options.vram_budget is not None and not options.vram:
+        raise ValueError("VRAM budget requires --vram.")
+    if options.attribute_map and not (options.map and (options.color or options.dx)):
+        raise ValueError("Attribute maps require map mode and color or DX mode.")
+    if options.priority and not options.attribute_map:
+        raise ValueError("A priority mask requires --attribute_map.")
+
+
+def check_images(options, palette_image=None, dx_image=None):
+    # the conversion functions take images instead of reading the files
+    # named in options, which would otherwise be ignored silently
+    if options.color and options.include_palette and palette_image is None:
+        raise ValueError("--include_palette is set but no palette image was given.")
+    if not options.color and options.dx and dx_image is None:
+        raise ValueError("--dx is set but no DX reference image was given.")
+
+
+def band_height(options):
+    return 16 if options.s8x16 else 8
+
+
+def allocate_vram(tile_data, tiles, attributes, tiles_x, options, info):
+    # Places the unique tiles of a map in VRAM. Returns the tile data of
+    # bank 0, the tile numbers and the attributes. In color mode tiles that
+    # do not fit in bank 0 go to bank 1, with the bank bit set in their
+    # attributes and their tile data in info["bank1_data"].
+    banks = 2 if options.color else 1
+    numbers, bank, used = vram.allocate(tiles, len(tile_data) // 16, tiles_x, options.vram, options.offset, options.vram_budget, banks)
+    info["vram_tiles"] = used
+    if options.color:
+        if attributes is None:
+            attributes = np.zeros(len(numbers), np.uint8)
+        attributes = attributes | bank * np.uint8(vram.BANK_BIT)
+        info["bank1_data"] = tile_data[used[0]*16:]
+    return tile_data[:used[0]*16], numbers, attributes
+
+
+def convert_bands(bands, width, height, colors, options=None, tile_index=None):
+    # Converts a DMG image given as an iterable of (rows, width) bands of
+    # band_height(options) rows each, so only one band needs to be in memory.
+    # In map mode tiles are added to tile_index if given, for sharing tiles
+    # between images. The tile data of the result is then None.
+    shared = tile_index is not None
+    if options is None:
+        options = make_options()
+
+    check_options(width, height, colors, options)
+    if options.color:
+        raise ValueError("Color mode needs the whole image.")
+
+    tiles_x = width // 8
+    tiles_y = height // 8
+
+    if not shared:
+        tile_index = tiledata.TileIndex(flip=options.flip)
+    tile_data, tiles = [], []
+
+    for band in profiler.iterate("decode", bands):
+        with profiler.stage("encode"):
+            band_tiles = len(band) // 8
+            td = tiledata.get_tiles(np.asarray(band).transpose(), tiles_x, band_tiles)
+            encoded = tiledata.encode_2bpp(td[tiledata.tile_order(tiles_x, band_tiles, options.s8x16)])
+        if options.map:
+            with profiler.stage("dedup"):
+                tiles.append(tile_index.add(encoded)[0])
+        else:
+            tile_data.append(encoded)
+
+    info = {}
+    if options.map:
+        tile_data = None if shared else tile_index.data()
+        tiles = np.concatenate(tiles) if tiles else np.zeros(0, np.intp)
+        if options.vram:
+            with profiler.stage("allocate"):
+                tile_data, tiles = allocate_vram(tile_data, tiles, None, tiles_x, options, info)[:2]
+        else:
+            tiles = tiles + options.offset
+    else:
+        tile_data = np.concatenate(tile_data) if tile_data else np.zeros(0, np.uint8)
+        tiles = None
+
+    return export.ConversionResult(tile_data, tiles, tiles_x, tiles_y, info=info)
+
+
+def convert(data, colors, options=None, palette_image=None, dx_image=None, tile_cache=None):
+    # data is a (height, width) array of palette indices into colors.
+    # palette_image and dx_image are (data, colors) pairs used in place of the
+    # --include_palette and --dx files. With a tiledata.TileCache holding the
+    # previous revision of the image only changed tiles are encoded again.
+    if options is None:
+        options = make_options()
+
+    data = np.asarray(data)
+    height, width = data.shape
+    colors = list(colors)
+
+    check_options(width, height, colors, options)
+    check_images(options, palette_image, dx_image)
+
+    if not options.color and dx_image is None and tile_cache is None:
+        rows = band_height(options)
+        return convert_bands((data[y:y+rows] for y in range(0, height, rows)), width, height, colors, options)
 
-    data = np.array(list(data_map)).transpose()
-    colors = meta["palette"]
+    data = data.transpose()
 
     tiles_x = width // 8
     tiles_y = height // 8
 
     palettes, palette_data = None, None
+    info = {}
+    encode_2bpp = tiledata.encode_2bpp if tile_cache is None else tile_cache.encode_2bpp
 
-    if args.s8x16:
-        tileorder = [(x // 2, y + x % 2) for y in range(0, tiles_y, 2) for x in range(tiles_x*2)]
-    else:
-        tileorder = [(x, y) for y in range(tiles_y) for x in range(tiles_x)]
-
-    if args.color:
-        palette_map = []
-        if args.include_palette:
-            colors, palette_map = read_palette_image(args.include_palette, colors)
-
-        palettes, palette_map = make_color_palettes(data, colors, palette_map, tiles_x, tiles_y)
-        tile_data = [convert_tile_color(data, palette_map[palettes[t[0]+t[1]*tiles_x]], t[0], t[1]) for t in tileorder]
-        tile_data_length = len(tile_data)
-        palette_data = []
-        for m in palette_map:
-            for i in range(4):
-                if i < len(m):
-                    palette_data.append(rgb_to_5bit(*colors[m[i]]))
-                else:
-                    palette_data.append(0)
+    with profiler.stage("encode"):
+        tileorder = tiledata.tile_order(tiles_x, tiles_y, options.s8x16)
+        td = tiledata.get_tiles(data, tiles_x, tiles_y)
 
-    else:
-        tile_data = [convert_tile(data, t[0], t[1]) for t in tileorder]
-        tile_data_length = len(tile_data)
+    if options.color:
+        with profiler.stage("palette"):
+            palette_map = []
+            if palette_image is not None:
+                colors, palette_map = merge_palette_image(np.asarray(palette_image[0]), palette_image[1], colors)
+
+            if options.packing == "optimal":
+                greedy_map = make_color_palettes(data, colors, [list(p) for p in palette_map], tiles_x, tiles_y)[1]
+                info["palettes_greedy"] = len(greedy_map)
+
+            palettes, palette_map = make_color_palettes(data, colors, palette_map, tiles_x, tiles_y, options.packing, options.packing_time)
+            info["palettes"] = len(palette_map)
+
+        with profiler.stage("encode"):
+            td = tiledata.remap_tiles(td, palettes, palette_map, len(colors))
+            tile_data = encode_2bpp(td[tileorder])
+        palette_data = make_palette_data(palette_map, colors)
 
-        if args.dx:
-            source_dx = png.Reader(args.dx)
-            width_dx, height_dx, data_map_dx, meta_dx = source_dx.read()
+    else:
+        with profiler.stage("encode"):
+            tile_data = encode_2bpp(td[tileorder])
 
-            if width_dx != width or height_dx != height:
+        if dx_image is not None:
+            data_dx = np.asarray(dx_image[0])
+            if data_dx.shape != (height, width):
                 raise ValueError("Dimension of DX reference image does not match input.")
-            if "palette" not in meta_dx:
-                raise ValueError("DX reference PNG image is not indexed.")
 
-            data_dx = np.array(list(data_map_dx)).transpose()
+            with profiler.stage("palette"):
+                palettes, palette_data = make_dx_palettes(data, data_dx.transpose(), dx_image[1], tiles_x, tiles_y)
+
+    if tile_cache is not None:
+        info["encoded_tiles"] = len(tile_cache.dirty)
 
-            palettes, palette_data = make_dx_palettes(data, data_dx, meta_dx["palette"], tiles_x, tiles_y)
+    if palettes is not None:
+        palettes = np.array(palettes) + options.palette_offset
 
-    if palettes != None:
-        palettes = [i + args.palette_offset for i in palettes]
+        if options.correct_lcd:
+            with profiler.stage("lcd"):
+                palette_data = lcd.correct_colors(palette_data)
+        palette_data = np.array(palette_data, np.uint16)
 
-        if args.correct_lcd:
-            lcd_map = lcd.build_lcd_map()
-            palette_data = [lcd.find_best(c, lcd_map) for c in palette_data]
+    tiles, attributes = None, None
 
-    if args.map:
-        tile_map = dict()
-        tiles = []
-        for tile in tile_data:
-            if tile not in tile_map:
-                tile_map[tile] = len(tile_map)
-            tiles.append(tile_map[tile])
+    if options.map:
+        with profiler.stage("dedup"):
+            tile_index = tiledata.TileIndex(flip=options.flip)
+            tiles, attributes = tile_index.add(tile_data)
+            tile_data = tile_index.data()
 
-        tile_data = np.zeros(16 * len(tile_map), np.uint8)
-        for k,v in tile_map.items():
-            tile_data[(v*16):(v+1)*16] = k
+        if not options.flip:
+            attributes = None
+        if options.vram:
+            with profiler.stage("allocate"):
+                tile_data, tiles, attributes = allocate_vram(tile_data, tiles, attributes, tiles_x, options, info)
+        else:
+            tiles = tiles + options.offset
+
+    return export.ConversionResult(tile_data, tiles, tiles_x, tiles_y, palettes, palette_data, attributes, info)
+
+
+def convert_incremental(data, colors, options=None, palette_image=None, state=None):
+    # Converts a map given the state of the previous conversion of the same
+    # image, as returned along with the result. Only tiles whose pixels
+    # changed are assigned palettes, encoded and deduplicated again. Other
+    # tiles keep their palette and tile index, and new tiles take the slots
+    # of tiles no longer in use.
+    if options is None:
+        options = make_options()
+
+    data = np.asarray(data)
+    height, width = data.shape
+    input_colors = list(colors)
+    colors = list(input_colors)
+
+    check_options(width, height, colors, options)
+    if not options.map:
+        raise ValueError("Incremental conversion requires map mode.")
+    if options.dx:
+        raise ValueError("Incremental conversion does not support DX mode.")
+    if options.vram:
+        raise ValueError("Incremental conversion does not support VRAM allocation.")
+    check_images(options, palette_image)
 
-        tiles = [i + args.offset for i in tiles]
+    tiles_x = width // 8
+    tiles_y = height // 8
+    count = tiles_x * tiles_y
 
-        if args.cfile:
+    palette_map = []
+    if options.color and palette_image is not None:
+        colors, palette_map = merge_palette_image(np.asarray(palette_image[0]), palette_image[1], colors)
+
+    td = tiledata.get_tiles(data.transpose(), tiles_x, tiles_y)
+    hashes = incremental.tile_hashes(td)
+    signature = incremental.signature(options, colors, width, height, palette_map)
+
+    if state is not None and str(state["signature"]) != signature:
+        state = None
+
+    if state is None:
+        changed = np.ones(count, bool)
+        palettes = np.zeros(count, np.intp)
+        unique = np.zeros((0, 16), np.uint8)
+        indices = np.zeros(count, np.intp)
+        attributes = np.zeros(count, np.uint8)
+    else:
+        changed = hashes != state["hashes"]
+        palettes = state["palettes"].astype(np.intp)
+        palette_map = incremental.unpack_palette_map(state["palette_map"])
+        unique = state["unique"]
+        indices = state["indices"].astype(np.intp)
+        attributes = state["attributes"]
+
+    palette_data = None
+    if options.color:
+        with profiler.stage("palette"):
+            dirty = np.flatnonzero(changed)
+            palettes[dirty], palette_map = make_tile_palettes(td[dirty], len(colors), palette_map, tiles_x, options.packing, options.packing_time, dirty)
+        # palettes only grow as tiles change, so colors of tiles no longer in
+        # the map can push the count past the 8 CGB palettes where a full
+        # conversion would fit
+        if state is not None and len(palette_map) > 8:
+            return convert_incremental(data, input_colors, options, palette_image, None)
+        palette_data = make_palette_data(palette_map, colors)
+
+    tileorder = tiledata.tile_order(tiles_x, tiles_y, options.s8x16)
+    dirty = np.flatnonzero(changed[tileorder])
+    with profiler.stage("encode"):
+        positions = tileorder[dirty]
+        tiles = td[positions]
+        if options.color:
+            tiles = tiledata.remap_tiles(tiles, palettes[positions], palette_map, len(colors))
+        encoded = tiledata.encode_2bpp(tiles)
+
+    with profiler.stage("dedup"):
+        unique, indices, attributes = incremental.update_tiles(unique, indices, attributes, dirty, encoded, options.flip)
+
+    state = {
+        "signature": np.array(signature),
+        "hashes": hashes,
+        "palettes": palettes,
+        "palette_map": incremental.pack_palette_map(palette_map),
+        "unique": unique,
+        "indices": indices,
+        "attributes": attributes
+    }
+
+    info = {"encoded_tiles": len(dirty)}
+    result_palettes = None
+    if options.color:
+        info["palettes"] = len(palette_map)
+        result_palettes = palettes + options.palette_offset
+        if options.correct_lcd:
+            with profiler.stage("lcd"):
+                palette_data = lcd.correct_colors(palette_data)
+        palette_data = np.array(palette_data, np.uint16)
+
+    result = export.ConversionResult(unique.reshape(-1), indices + options.offset, tiles_x, tiles_y, result_palettes, palette_data, attributes if options.flip else None, info)
+    return result, state
+
+
+def convert_metasprites(data, colors, options=None, palette_image=None, dx_image=None, tile_cache=None):
+    # Converts a sprite sheet into frames of options.metasprite pixels. The
+    # frames are stored in info["frames"] as tables of (dy, dx, tile, attr),
+    # with empty sprites dropped and the others deduplicated over all frames.
+    options = argparse.Namespace(**vars(options or make_options()))
+    if options.map:
+        raise ValueError("Metasprite mode can not be combined with map mode.")
+    result = convert(data, colors, options, palette_image, dx_image, tile_cache)
+
+    frame_width, frame_height = options.metasprite
+    unit_height = band_height(options)
+    if frame_width <= 0 or frame_height <= 0 or frame_width % 8 != 0 or frame_height % unit_height != 0:
+        raise ValueError("Frame size must be a multiple of 8x{}.".format(unit_height))
+
+    units_x = result.tiles_width
+    units_y = result.tiles_height * 8 // unit_height
+
+    palettes = None
+    if result.palettes is not None:
+        palettes = np.asarray(result.palettes).reshape(result.tiles_height, result.tiles_width)
+        if options.s8x16:
+            if (palettes[0::2] != palettes[1::2]).any():
+                raise ValueError("The halves of an 8x16 sprite use different palettes.")
+            palettes = palettes[0::2]
+        palettes = palettes.reshape(-1)
+        if len(palettes) > 0 and palettes.max() > 7:
+            raise ValueError("Sprites use more than 8 palettes.")
+
+    tile_data, frames = metasprite.build(result.tile_data.reshape(units_x * units_y, -1), units_x, units_y, frame_width // 8, frame_height // unit_height, unit_height, options.flip, palettes, options.offset)
+
+    info = dict(result.info)
+    info["frames"] = frames
+    info["raw_tiles"] = len(result.tile_data) // 16
+    return export.ConversionResult(tile_data, None, result.tiles_width, result.tiles_height, palettes, result.palette_data, None, info)
+
+
+def convert_map(data, colors, options=None, palette_image=None, dx_image=None):
+    options = argparse.Namespace(**vars(options or make_options()))
+    options.map = True
+    return convert(data, colors, options, palette_image, dx_image)
+
+
+def convert_sprites(data, colors, options=None, palette_image=None, dx_image=None):
+    options = argparse.Namespace(**vars(options or make_options()))
+    options.map = False
+    return convert(data, colors, options, palette_image, dx_image)
+
+
+def write_result(result, options, outfile, cfile=None, stats=None):
+    # tile numbers are signed in $8800 mode, the offset define holds the byte
+    offset = options.offset & 0xFF if options.vram else options.offset
+    bank1_data = result.info.get("bank1_data")
+    if options.metasprite:
+        if cfile:
+            raise ValueError("Metasprites can not be written to a C source file.")
+        if options.format == "bin":
+            export.write_metasprites_binary(outfile, result.tile_data, result.info["frames"], options.metasprite[0], options.metasprite[1], result.palette_data, rle=options.rle or options.rle_data, codec=options.codec, verify=options.verify, stats=stats)
+        else:
+            export.write_metasprites_c_header(outfile, result.tile_data, result.info["frames"], options.metasprite[0], options.metasprite[1], result.palette_data, rle=options.rle or options.rle_data, codec=options.codec, verify=options.verify, stats=stats, hexadecimal=options.hex)
+
+    elif options.chunks:
+        if cfile:
+            raise ValueError("Chunked tile maps can not be written to a C source file.")
+        if options.format == "bin":
+            export.write_chunked_map_binary(
+                outfile, result.tile_data, result.tiles, result.tiles_width, result.tiles_height, options.offset,
+                options.chunks[0], options.chunks[1],
+                result.palettes, result.palette_data, options.palette_offset,
+                rle_data=options.rle or options.rle_data,
+                rle_tiles=options.rle or options.rle_tiles,
+                attributes=result.attributes,
+                bank=options.bank,
+                bank_size=options.bank_size,
+                codec=options.codec,
+                verify=options.verify,
+                stats=stats)
+        else:
+            export.write_chunked_map_c_header(
+                outfile, result.tile_data, result.tiles, result.tiles_width, result.tiles_height, options.offset,
+                options.chunks[0], options.chunks[1],
+                result.palettes, result.palette_data, options.palette_offset,
+                rle_data=options.rle or options.rle_data,
+                rle_tiles=options.rle or options.rle_tiles,
+                attributes=result.attributes,
+                bank=options.bank,
+                bank_size=options.bank_size,
+                codec=options.codec,
+                verify=options.verify,
+                stats=stats,
+                hexadecimal=options.hex)
+
+    elif options.format == "bin":
+        if options.map:
+            export.write_map_binary(
+                outfile, result.tile_data, result.tiles, result.tiles_width, result.tiles_height, offset,
+                options.split_data, options.split_tiles,
+                result.palettes, result.palette_data, options.palette_offset,
+                rle_data=options.rle or options.rle_data,
+                rle_tiles=options.rle or options.rle_tiles,
+                attributes=result.attributes,
+                codec=options.codec,
+                verify=options.verify,
+                stats=stats,
+                bank1_data=bank1_data)
+        else:
+            export.write_sprites_binary(outfile, result.tile_data, result.palettes, result.palette_data, rle=options.rle or options.rle_data, codec=options.codec, verify=options.verify, stats=stats)
+
+    elif options.map:
+        if cfile:
             export.write_map_c_source(
-                args.cfile, args.outfile,
-                tile_data, tiles, tiles_x, tiles_y, args.offset,
-                args.split_data, args.split_tiles,
-                palettes, palette_data, args.palette_offset,
-                rle_data=args.rle or args.rle_data,
-                rle_tiles=args.rle or args.rle_tiles)
+                cfile, outfile,
+                result.tile_data, result.tiles, result.tiles_width, result.tiles_height, offset,
+                options.split_data, options.split_tiles,
+                result.palettes, result.palette_data, options.palette_offset,
+                rle_data=options.rle or options.rle_data,
+                rle_tiles=options.rle or options.rle_tiles,
+                attributes=result.attributes,
+                codec=options.codec,
+                verify=options.verify,
+                stats=stats,
+                hexadecimal=options.hex,
+                bank1_data=bank1_data)
         else:
             export.write_map_c_header(
-                args.outfile, tile_data, tiles, tiles_x, tiles_y, args.offset,
-                args.split_data, args.split_tiles,
-                palettes, palette_data, args.palette_offset,
-                rle_data=args.rle or args.rle_data,
-                rle_tiles=args.rle or args.rle_tiles)
+                outfile, result.tile_data, result.tiles, result.tiles_width, result.tiles_height, offset,
+                options.split_data, options.split_tiles,
+                result.palettes, result.palette_data, options.palette_offset,
+                rle_data=options.rle or options.rle_data,
+                rle_tiles=options.rle or options.rle_tiles,
+                attributes=result.attributes,
+                codec=options.codec,
+                verify=options.verify,
+                stats=stats,
+                hexadecimal=options.hex,
+                bank1_data=bank1_data)
 
     else:
-        tile_data = np.fromiter(itertools.chain.from_iterable(tile_data), np.uint8)
-        if args.cfile:
-            export.write_sprites_c_source(args.cfile, args.outfile, tile_data, palettes, palette_data, rle=args.rle or args.rle_data)
+        if cfile:
+            export.write_sprites_c_source(cfile, outfile, result.tile_data, result.palettes, result.palette_data, rle=options.rle or options.rle_data, codec=options.codec, verify=options.verify, stats=stats, hexadecimal=options.hex)
+        else:
+            export.write_sprites_c_header(outfile, result.tile_data, result.palettes, result.palette_data, rle=options.rle or options.rle_data, codec=options.codec, verify=options.verify, stats=stats, hexadecimal=options.hex)
+
+
+def convert_file(args, tile_cache=None):
+    if args.format == "bin" and args.cfile:
+        raise ValueError("C source output can not be used with binary format.")
+
+    if args.incremental:
+        with profiler.stage("decode"):
+            data, meta = image.read_png(args.infile)
+            if "palette" not in meta:
+                raise ValueError("PNG image is not indexed.")
+            palette_image = None
+            if args.color and args.include_palette:
+                palette_image = read_palette_image(args.include_palette)
+
+        state_path = incremental.state_path(args.outfile)
+        result, state = convert_incremental(data, meta["palette"], args, palette_image, incremental.load_state(state_path))
+    elif not args.color and not args.dx and not args.metasprite and tile_cache is None:
+        width, height, meta, bands = image.read_png_bands(args.infile, band_height(args))
+        if "palette" not in meta:
+            raise ValueError("PNG image is not indexed.")
+        result = convert_bands(bands, width, height, meta["palette"], args)
+    else:
+        with profiler.stage("decode"):
+            data, meta = image.read_png(args.infile)
+            if "palette" not in meta:
+                raise ValueError("PNG image is not indexed.")
+
+            palette_image, dx_image = None, None
+            if args.color and args.include_palette:
+                palette_image = read_palette_image(args.include_palette)
+            if not args.color and args.dx:
+                data_dx, meta_dx = image.read_png(args.dx)
+                if "palette" not in meta_dx:
+                    raise ValueError("DX reference PNG image is not indexed.")
+                dx_image = (data_dx, meta_dx["palette"])
+
+        if args.metasprite:
+            result = convert_metasprites(data, meta["palette"], args, palette_image, dx_image, tile_cache)
         else:
-            export.write_sprites_c_header(args.outfile, tile_data, palettes, palette_data, rle=args.rle or args.rle_data)
+            result = convert(data, meta["palette"], args, palette_image, dx_image, tile_cache)
+
+    if args.attribute_map:
+        with profiler.stage("attributes"):
+            result = pack_attributes(result, read_priority_mask(args.priority) if args.priority else None)
+
+    profiler.metric("tiles", result.tiles_width * result.tiles_height)
+    profiler.metric("unique_tiles", (len(result.tile_data) + len(result.info.get("bank1_data", ()))) // 16)
+    if result.palette_data is not None:
+        profiler.metric("palettes", len(result.palette_data) // 4)
+
+    stats = [] if args.codec_stats else None
+    with profiler.stage("emit"):
+        write_result(result, args, args.outfile, args.cfile, stats)
+
+    if args.incremental:
+        incremental.save_state(state_path, state)
+        print("Encoded {} of {} tiles.".format(result.info["encoded_tiles"], result.tiles_width * result.tiles_height))
+
+    if "palettes_greedy" in result.info:
+        print(packing.report(result.info))
+    if "vram_tiles" in result.info:
+        print(vram.report(args.vram, args.offset, result.info["vram_tiles"]))
+    if args.metasprite:
+        print(metasprite.report(result.info["frames"], result.tile_data, result.info["raw_tiles"]))
+    if stats:
+        print(compression.format_stats(stats))
+    return result
+
+
+def run(args):
+    if profiler.enabled(args):
+        return profiler.run(args, convert_file)
+    # binary and chunked output write files not known up front and incremental state
+    # depends on earlier runs, neither of which the cache can track
+    if args.format == "bin" or args.incremental or args.chunks:
+        convert_file(args)
+        return False
+    return cache.run_cached("imgtogb", args, ("infile", "include_palette", "dx", "priority"), ("outfile", "cfile"), convert_file)
+
+
+def main(argv=None):
+    run(build_parser().parse_args(argv))
+
 
 if __name__ == "__main__":
     main()
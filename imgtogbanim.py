@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import argparse
+import numpy as np
+import animation
+import cli
+import compression
+import export
+import image
+import imgtogb
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert the frames of an animated DMG map to patches between frames.")
+    parser.add_argument("outfile", help="Output file.", type=str)
+    parser.add_argument("infiles", help="Image files, one per frame in order unless --frame_size is given.", type=str, nargs="+")
+    parser.add_argument("-s", "--frame_size", help="Slice each image into frames of WxH pixels in row-major order, for animation strips.", type=imgtogb.dimensions)
+    parser.add_argument("-R", "--rle_data", help="Compress the tile data of the first frame.", action="store_true")
+    parser.add_argument("-T", "--rle_tiles", help="Compress the tile map of the first frame.", action="store_true")
+    parser.add_argument("--codec", help="Compression codec. \"auto\" picks the smallest output for each array.", choices=compression.CODEC_CHOICES, default="rle")
+    parser.add_argument("--codec_stats", help="Print compression ratio and encode time of each compressed array.", action="store_true")
+    parser.add_argument("-O", "--offset", help="Tile map offset.", type=int, default=0)
+    parser.add_argument("--format", help="Output format. \"bin\" writes raw arrays to binary files next to the header.", choices=["c", "bin"], default="c")
+    parser.add_argument("--hex", help="Write array values in hexadecimal.", action="store_true")
+    parser.add_argument("--verify", help="Check that compressed arrays decompress to the original data.", action="store_true")
+    return parser
+
+
+def make_options(**kwargs):
+    return cli.make_options(build_parser(), **kwargs)
+
+
+def split_frames(data, frame_size):
+    # Slices a (height, width) image into frames in row-major order.
+    if frame_size is None:
+        return [data]
+    frame_width, frame_height = frame_size
+    height, width = data.shape
+    if frame_width <= 0 or frame_height <= 0 or width % frame_width != 0 or height % frame_height != 0:
+        raise ValueError("Image size not divisible by frame size.")
+    frames = data.reshape(height // frame_height, frame_height, width // frame_width, frame_width)
+    return list(frames.transpose(0, 2, 1, 3).reshape(-1, frame_height, frame_width))
+
+
+def read_frames(infiles, frame_size=None):
+    # Returns the frames of all images as an (F, height, width) array.
+    frames = []
+    for infile in infiles:
+        data, meta = image.read_png(infile)
+        if "palette" not in meta:
+            raise ValueError("PNG image \"{}\" is not indexed.".format(infile))
+        for frame in split_frames(data, frame_size):
+            if frames and frame.shape != frames[0].shape:
+                raise ValueError("Frames of \"{}\" do not match the size of the first frame.".format(infile))
+            imgtogb.check_options(frame.shape[1], frame.shape[0], meta["palette"], imgtogb.make_options(map=True))
+            frames.append(frame)
+    return np.stack(frames)
+
+
+def convert(frames, options=None):
+    # frames is an (F, height, width) array of DMG color indices.
+    if options is None:
+        options = make_options()
+    frames = np.asarray(frames)
+    tiles_x = frames.shape[2] // 8
+    tiles_y = frames.shape[1] // 8
+
+    tile_data, tiles, slot_count, tile_patches, tile_bounds, map_patches, map_bounds = animation.build(frames, tiles_x, tiles_y, options.offset)
+
+    info = {
+        "slot_count": slot_count,
+        "tile_patches": tile_patches,
+        "tile_bounds": tile_bounds,
+        "map_patches": map_patches,
+        "map_bounds": map_bounds
+    }
+    return export.ConversionResult(tile_data, tiles, tiles_x, tiles_y, info=info)
+
+
+def convert_file(args):
+    result = convert(read_frames(args.infiles, args.frame_size), args)
+    info = result.info
+    stats = [] if args.codec_stats else None
+
+    if args.format == "bin":
+        export.write_animation_binary(args.outfile, result.tile_data, result.tiles, result.tiles_width, result.tiles_height, args.offset, info["slot_count"], info["tile_patches"], info["tile_bounds"], info["map_patches"], info["map_bounds"], rle_data=args.rle_data, rle_tiles=args.rle_tiles, codec=args.codec, verify=args.verify, stats=stats)
+    else:
+        export.write_animation_c_header(args.outfile, result.tile_data, result.tiles, result.tiles_width, result.tiles_height, args.offset, info["slot_count"], info["tile_patches"], info["tile_bounds"], info["map_patches"], info["map_bounds"], rle_data=args.rle_data, rle_tiles=args.rle_tiles, codec=args.codec, verify=args.verify, stats=stats, hexadecimal=args.hex)
+
+    print(animation.report(len(info["tile_bounds"]) - 1, result.tiles, info["slot_count"], info["tile_patches"], info["map_patches"]))
+    if stats:
+        print(compression.format_stats(stats))
+
+
+def main(argv=None):
+    convert_file(build_parser().parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
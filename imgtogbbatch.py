@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import concurrent.futures
+import imgtogb
+import imgtosgb
+import imgtogbpal
+
+
+TOOLS = {
+    "imgtogb": imgtogb,
+    "imgtosgb": imgtosgb,
+    "imgtogbpal": imgtogbpal
+}
+
+PATH_OPTIONS = ("infile", "outfile", "cfile", "include_palette", "dx", "priority")
+
+
+def read_manifest(path):
+    # A manifest has a "jobs" list and an optional "defaults" table holding
+    # default options per tool. Each job names its "tool" (imgtogb by default),
+    # "infile" and "outfile", and any other keys are option names as accepted
+    # by that tool's make_options. Relative paths are resolved against the
+    # manifest directory.
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+
+    if "jobs" not in manifest:
+        raise ValueError("Manifest has no jobs.")
+
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+
+    jobs = []
+    for entry in manifest["jobs"]:
+        tool = entry.get("tool", "imgtogb")
+        if tool not in TOOLS:
+            raise ValueError("Unknown tool \"{}\".".format(tool))
+
+        job = dict(defaults.get(tool, {}))
+        job.update(entry)
+        job["tool"] = tool
+        if "infile" not in job or "outfile" not in job:
+            raise ValueError("Job is missing infile or outfile.")
+
+        for k in PATH_OPTIONS:
+            if job.get(k):
+                job[k] = os.path.join(base, job[k])
+        jobs.append(job)
+
+    return jobs
+
+
+def make_job_options(job):
+    job = dict(job)
+    tool = TOOLS[job.pop("tool")]
+    infile, outfile = job.pop("infile"), job.pop("outfile")
+    options = tool.make_options(**job)
+    options.infile, options.outfile = infile, outfile
+    return tool, options
+
+
+def run_job(job):
+    start = time.perf_counter()
+    error, cached = None, False
+    try:
+        tool, options = make_job_options(job)
+        cached = tool.run(options)
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+
+    return {
+        "infile": job.get("infile"),
+        "outfile": job.get("outfile"),
+        "time": time.perf_counter() - start,
+        "cached": cached,
+        "error": error
+    }
+
+
+def run_batch(jobs, workers=None):
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="JSON or TOML manifest listing conversion jobs.", type=str)
+    parser.add_argument("-j", "--jobs", help="Number of worker processes. Defaults to the number of CPUs.", type=int)
+    parser.add_argument("--report", help="Write per-file results to JSON file.", type=str)
+    parser.add_argument("-q", "--quiet", help="Only print failures and the summary.", action="store_true")
+    parser.add_argument("--cache", help="Use the conversion cache for all jobs.", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        raise ValueError("Number of jobs must be 1 or more.")
+
+    jobs = read_manifest(args.manifest)
+    if args.cache:
+        for job in jobs:
+            job["cache"] = True
+
+    start = time.perf_counter()
+    results = run_batch(jobs, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    failed = [r for r in results if r["error"]]
+    for r in results:
+        if r["error"]:
+            print("FAIL {:8.3f}s {}: {}".format(r["time"], r["infile"], r["error"]))
+        elif not args.quiet:
+            print("{} {:8.3f}s {}".format("hit " if r["cached"] else "ok  ", r["time"], r["infile"]))
+
+    print("{} converted, {} failed in {:.3f}s".format(len(results) - len(failed), len(failed), elapsed))
+    if any(job.get("cache") for job in jobs):
+        hits = sum(r["cached"] for r in results)
+        print("Cache hits: {}/{} ({:.1f}%)".format(hits, len(results), 100 * hits / len(results)))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"time": elapsed, "results": results}, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
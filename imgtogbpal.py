@@ -1,72 +1,78 @@
 #!/usr/bin/env python3
-import os
 import argparse
-import png
 import numpy as np
-from string import Template
 from colors import rgb_to_5bit
-from export import pretty_data
+import cache
+import cli
+import export
+import image
 import lcd
+import profiler
 
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("infile", help="Image file.", type=str)
     parser.add_argument("outfile", help="Output file.", type=str) 
     parser.add_argument("-b","--bytes", help="Output bytes instead of words.", action="store_true")
     parser.add_argument("-l","--correct_lcd", help="Correct colors for GBC LCD.", action="store_true")
-    args = parser.parse_args()
+    cache.add_arguments(parser)
+    profiler.add_arguments(parser)
+    return parser
 
-    source = png.Reader(args.infile)
-    width, height, data_map, meta = source.read()
 
-    if width != 4:
+def make_options(**kwargs):
+    return cli.make_options(build_parser(), **kwargs)
+
+
+def convert_palette(data, colors, options=None):
+    # data is a (height, 4) array of indices into colors, one palette per row.
+    if options is None:
+        options = make_options()
+
+    data = np.asarray(data)
+    if data.shape[1] != 4:
         raise ValueError("Image must be 4 pixels wide.")
-    if "palette" not in meta:
-        raise ValueError("PNG image is not indexed.")
 
-    data = np.array(list(data_map)).transpose()
+    with profiler.stage("palette"):
+        out = [rgb_to_5bit(*colors[i]) for i in data.reshape(-1)]
+
+    if options.correct_lcd:
+        with profiler.stage("lcd"):
+            out = lcd.correct_colors(out)
 
-    palette = meta["palette"]
+    return np.array(out, np.uint16)
 
-    out = [rgb_to_5bit(*palette[data[x,y]]) for y in range(height) for x in range(4)]
 
-    if args.correct_lcd:
-        lcd_map = lcd.build_lcd_map()
-        out = [lcd.find_best(c, lcd_map) for c in out]
+def write_result(palette_data, options, outfile):
+    export.write_palette_c_header(outfile, palette_data, options.bytes)
+
+
+def convert_file(args):
+    with profiler.stage("decode"):
+        data, meta = image.read_png(args.infile)
+
+    if data.shape[1] != 4:
+        raise ValueError("Image must be 4 pixels wide.")
+    if "palette" not in meta:
+        raise ValueError("PNG image is not indexed.")
 
-    datatype = "int"
-    pdlen = len(out) // 4
+    palette_data = convert_palette(data, meta["palette"], args)
+    profiler.metric("palettes", len(palette_data) // 4)
 
-    if args.bytes:
-        datatype = "char"
-        out2 = []
-        for x in out:
-            out2.append(x & 0xFF)
-            out2.append(x >> 8)
-        out = out2
+    with profiler.stage("emit"):
+        write_result(palette_data, args, args.outfile)
 
-    name = os.path.splitext(os.path.basename(args.outfile))[0]
 
-    s = Template("""#ifndef ${uname}_PALETTE_H
-#define ${uname}_PALETTE_H
+def run(args):
+    if profiler.enabled(args):
+        return profiler.run(args, convert_file)
+    return cache.run_cached("imgtogbpal", args, ("infile",), ("outfile",), convert_file)
 
-#define ${name}_palette_data_length ${pdlen}U
-const unsigned ${datatype} ${name}_palette_data[] = {
-    ${data}
-};
 
-#endif
-""").substitute(
-        name=name,
-        uname=name.upper(),
-        pdlen=pdlen,
-        datatype=datatype,
-        data=pretty_data(out, 4)
-    )
+def main(argv=None):
+    run(build_parser().parse_args(argv))
 
-    with open(args.outfile, "w") as f:
-        f.write(s)
 
 if __name__ == "__main__":
     main()
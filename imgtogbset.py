@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import os
+import json
+import argparse
+import numpy as np
+import cache
+import cli
+import compression
+import export
+import image
+import imgtogb
+import incremental
+import tiledata
+
+# tile map entries are one byte, so a tileset holds at most 256 tiles
+AREA_TILES = 256
+
+STATE_KEYS = ("signature", "names", "file_hashes", "bounds", "indices", "tiles")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert a set of DMG maps sharing one tileset.")
+    parser.add_argument("outfile", help="Output file for the shared tile data.", type=str)
+    parser.add_argument("infiles", help="Image files.", type=str, nargs="+")
+    parser.add_argument("-o", "--outdir", help="Output directory for the tile map of each image. Defaults to the directory of outfile.", type=str)
+    parser.add_argument("-r", "--rle", help="Compress tile data and tile maps.", action="store_true")
+    parser.add_argument("-R", "--rle_data", help="Compress tile data.", action="store_true")
+    parser.add_argument("-T", "--rle_tiles", help="Compress tile maps.", action="store_true")
+    parser.add_argument("--codec", help="Compression codec. \"auto\" picks the smallest output for each array.", choices=compression.CODEC_CHOICES, default="rle")
+    parser.add_argument("--codec_stats", help="Print compression ratio and encode time of each compressed array.", action="store_true")
+    parser.add_argument("-O", "--offset", help="Tile map offset.", type=int, default=0)
+    parser.add_argument("--hex", help="Write array values in hexadecimal.", action="store_true")
+    parser.add_argument("--verify", help="Check that compressed arrays decompress to the original data.", action="store_true")
+    parser.add_argument("--incremental", help="Keep the tileset in a file next to outfile and only convert images that changed on the next run. Tiles keep their index.", action="store_true")
+    return parser
+
+
+def make_options(**kwargs):
+    return cli.make_options(build_parser(), **kwargs)
+
+
+class Tileset:
+    # Tiles shared by a set of maps, with the tile indices of each map by
+    # name. Maps are added one at a time and only the tiles of the added map
+    # are hashed. A map added again replaces its earlier version, and new
+    # tiles take the slots of tiles no map uses anymore, so the tiles of
+    # other maps keep their index.
+    def __init__(self, options=None, state=None):
+        if options is None:
+            options = make_options()
+        self.options = options
+        self.map_options = imgtogb.make_options(map=True)
+        self.tiles = np.zeros((0, 16), np.uint8)
+        self.maps = {}
+        if state is not None:
+            self.tiles = state["tiles"].reshape(-1, 16)
+            bounds = state["bounds"]
+            for i, name in enumerate(state["names"]):
+                self.maps[str(name)] = state["indices"][bounds[i]:bounds[i+1]].astype(np.intp)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def add_bands(self, bands, width, height, colors, name=None):
+        index = tiledata.TileIndex()
+        result = imgtogb.convert_bands(bands, width, height, colors, self.map_options, index)
+        encoded = index.data().reshape(-1, 16)[result.tiles]
+
+        if name is None:
+            name = len(self.maps)
+        self.maps.pop(name, None)
+        indices = np.concatenate(list(self.maps.values()) + [np.zeros(len(encoded), np.intp)])
+        dirty = np.arange(len(indices) - len(encoded), len(indices))
+        self.tiles, indices, _ = incremental.update_tiles(self.tiles, indices, np.zeros(len(indices), np.uint8), dirty, encoded)
+        self.maps[name] = indices[dirty]
+
+        count = len(self) + self.options.offset
+        if count > AREA_TILES:
+            raise ValueError("Shared tileset needs {} tiles with offset {} after adding \"{}\", tile numbers exceed 255.".format(count, self.options.offset, name))
+
+        result.tiles = self.maps[name] + self.options.offset
+        return result
+
+    def add(self, data, colors, name=None):
+        # data is a (height, width) array of palette indices into colors.
+        data = np.asarray(data)
+        height, width = data.shape
+        return self.add_bands((data[y:y+8] for y in range(0, height, 8)), width, height, list(colors), name)
+
+    def remove(self, name):
+        # tiles only used by the map stay in the tileset until reused
+        del self.maps[name]
+
+    def data(self):
+        return self.tiles.reshape(-1)
+
+    def state(self):
+        indices = list(self.maps.values())
+        return {
+            "names": np.array([str(n) for n in self.maps]),
+            "bounds": np.cumsum([0] + [len(i) for i in indices]),
+            "indices": np.concatenate(indices) if indices else np.zeros(0, np.intp),
+            "tiles": self.tiles
+        }
+
+
+def map_path(infile, options):
+    outdir = options.outdir or os.path.dirname(options.outfile)
+    return os.path.join(outdir, os.path.splitext(os.path.basename(infile))[0] + ".h")
+
+
+def signature(options):
+    # skipped maps keep their tile map header, so it must be written the same
+    keys = ("offset", "rle", "rle_tiles", "codec", "hex")
+    return json.dumps([getattr(options, k) for k in keys])
+
+
+def convert_file(args):
+    state_path = incremental.state_path(args.outfile)
+    state = incremental.load_state(state_path, STATE_KEYS) if args.incremental else None
+    if state is not None and str(state["signature"]) != signature(args):
+        state = None
+
+    tileset = Tileset(args, state)
+    file_hashes = {}
+    if state is not None:
+        file_hashes = dict(zip((str(n) for n in state["names"]), (str(h) for h in state["file_hashes"])))
+        for name in list(tileset.maps):
+            if name not in args.infiles:
+                tileset.remove(name)
+    stats = [] if args.codec_stats else None
+
+    for infile in args.infiles:
+        path = map_path(infile, args)
+        if args.incremental:
+            file_hash = cache.hash_file(infile)
+            if file_hashes.get(infile) == file_hash and infile in tileset.maps and os.path.exists(path):
+                continue
+            file_hashes[infile] = file_hash
+
+        width, height, meta, bands = image.read_png_bands(infile)
+        if "palette" not in meta:
+            raise ValueError("PNG image \"{}\" is not indexed.".format(infile))
+        result = tileset.add_bands(bands, width, height, meta["palette"], infile)
+
+        export.write_tilemap_c_header(
+            path, result.tiles, result.tiles_width, result.tiles_height, args.offset,
+            rle=args.rle or args.rle_tiles,
+            codec=args.codec,
+            verify=args.verify,
+            stats=stats,
+            hexadecimal=args.hex)
+
+    export.write_tileset_c_header(args.outfile, tileset.data(), rle=args.rle or args.rle_data, codec=args.codec, verify=args.verify, stats=stats, hexadecimal=args.hex)
+
+    if args.incremental:
+        state = tileset.state()
+        state["signature"] = np.array(signature(args))
+        state["file_hashes"] = np.array([file_hashes[n] for n in tileset.maps])
+        incremental.save_state(state_path, state)
+    if stats:
+        print(compression.format_stats(stats))
+
+
+def main(argv=None):
+    convert_file(build_parser().parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+import imgtogb
+import imgtogbbatch
+import lcd
+import tiledata
+
+INPUT_OPTIONS = ("infile", "include_palette", "dx", "priority")
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class Watcher:
+    # Converts the jobs of a batch manifest whenever one of their input files
+    # or the manifest itself changes. Modules, the LCD correction table and
+    # the tiles of the last revision of each imgtogb input stay in memory, so
+    # a changed image only has its changed tiles encoded again.
+    def __init__(self, manifest, log=print):
+        self.manifest = manifest
+        self.log = log
+        self.manifest_mtime = None
+        self.jobs = []
+        self.mtimes = {}
+        self.tile_caches = {}
+
+    def load(self):
+        self.manifest_mtime = mtime(self.manifest)
+        self.jobs = imgtogbbatch.read_manifest(self.manifest)
+        self.mtimes = {}
+        self.tile_caches = {}
+        if any(job.get("correct_lcd") for job in self.jobs):
+            lcd.get_lcd_table()
+
+    def inputs(self, job):
+        return [job[k] for k in INPUT_OPTIONS if job.get(k)]
+
+    def convert(self, i, job):
+        start = time.perf_counter()
+        tool, options = imgtogbbatch.make_job_options(job)
+        detail = ""
+        if tool is imgtogb:
+            # incremental jobs keep their own state instead of the tile cache
+            result = tool.convert_file(options, self.tile_caches.setdefault(i, tiledata.TileCache()))
+            if "encoded_tiles" in result.info:
+                detail = " ({}/{} tiles encoded)".format(result.info["encoded_tiles"], result.tiles_width * result.tiles_height)
+        else:
+            tool.convert_file(options)
+        self.log("ok   {:7.1f}ms {}{}".format(1000 * (time.perf_counter() - start), job["infile"], detail))
+
+    def poll(self):
+        # Converts jobs with changed inputs. Returns the number of jobs run.
+        if mtime(self.manifest) != self.manifest_mtime:
+            try:
+                self.load()
+            except (OSError, ValueError) as e:
+                self.log("FAIL {}: {}".format(self.manifest, e))
+                return 0
+
+        count = 0
+        for i, job in enumerate(self.jobs):
+            stamps = [mtime(p) for p in self.inputs(job)]
+            if self.mtimes.get(i) == stamps or None in stamps:
+                continue
+            self.mtimes[i] = stamps
+            count += 1
+            try:
+                self.convert(i, job)
+            except Exception as e:
+                self.tile_caches.pop(i, None)
+                self.log("FAIL {}: {}: {}".format(job["infile"], type(e).__name__, e))
+        return count
+
+    def watch(self, interval=0.1):
+        while True:
+            self.poll()
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the jobs of a batch manifest whenever their images change.")
+    parser.add_argument("manifest", help="JSON or TOML manifest listing conversion jobs.", type=str)
+    parser.add_argument("-i", "--interval", help="Seconds between checks for changed files.", type=float, default=0.1)
+    parser.add_argument("--once", help="Convert all jobs once and exit.", action="store_true")
+    args = parser.parse_args(argv)
+
+    watcher = Watcher(args.manifest)
+    watcher.load()
+    if args.once:
+        watcher.poll()
+        return 0
+
+    try:
+        watcher.watch(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,14 @@
 #!/usr/bin/env python3
 import argparse
-import png
 import numpy as np
+import cache
+import cli
+import compression
 import export
-
-def convert_tile(data, palette, x, y):
-    m = {}
-    for i in range(len(palette)):
-        m[palette[i]] = i
-
-    px, py = x*8, y*8
-    td = data[px:px+8, py:py+8]
-
-    out = []
-    for iy in range(8):
-        b0, b1 = 0, 0
-        for ix in range(0, 8):
-            v = m[td[ix, iy]] & 3
-
-            b0 |= (v & 1) << (7 - ix)
-            b1 |= ((v & 2) >> 1) << (7 - ix)
-
-        out.append(b0)
-        out.append(b1)
-
-    for iy in range(8):
-        b0, b1 = 0, 0
-        for ix in range(0, 8):
-            v = m[td[ix, iy]] >> 2
-
-            b0 |= (v & 1) << (7 - ix)
-            b1 |= ((v & 2) >> 1) << (7 - ix)
-
-        out.append(b0)
-        out.append(b1)
-
-    return tuple(out)
-
+import image
+import packing
+import profiler
+import tiledata
 
 def palette_to_15bit(r, g, b, a):
     ri = round(r / 255 * 31)
@@ -55,7 +27,7 @@ def consolidate_transparent(data, width, height, colors):
     return data, colors
 
 
-def make_palettes(data, width, height, colors):
+def make_palettes(data, width, height, colors, packing_mode="greedy", time_budget=1.0):
     palette_map = []
     palettes = []
 
@@ -64,6 +36,9 @@ def make_palettes(data, width, height, colors):
 
     trans = next(i for i in range(len(colors)) if colors[i][3] < 255)
 
+    if packing_mode == "optimal":
+        return make_palettes_optimal(data, tiles_x, tiles_y, colors, trans, time_budget)
+
     for y in range(tiles_y):
         for x in range(tiles_x):
             px, py = x*8, y*8
@@ -92,43 +67,74 @@ def make_palettes(data, width, height, colors):
     return palettes, palette_map
 
 
-def main():
+def make_palettes_optimal(data, tiles_x, tiles_y, colors, trans, time_budget):
+    # every palette starts with the transparent color, so include it in all
+    # tile color sets and move it to the front of each packed palette
+    td = tiledata.get_tiles(data, tiles_x, tiles_y)
+    masks, counts = tiledata.color_masks(td, len(colors))
+    masks = [m | (1 << trans) for m in masks]
+
+    for i, m in enumerate(masks):
+        if m.bit_count() > 16:
+            raise ValueError("Tile ({},{}) contains more than 16 different colors.".format(i % tiles_x, i // tiles_x))
+
+    palettes, palette_map = packing.pack(masks, 16, None, time_budget)
+    palette_map = [[trans] + [c for c in m if c != trans] for m in palette_map]
+    return palettes, palette_map
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("infile", help="Image file.", type=str)
     parser.add_argument("outfile", help="Output file.", type=str)
-    parser.add_argument("-r","--rle", help="Compress data and tile map using RLE.", action="store_true")
+    parser.add_argument("-r","--rle", help="Compress data and tile map.", action="store_true")
+    parser.add_argument("--codec", help="Compression codec. \"auto\" picks the smallest output for each array.", choices=compression.CODEC_CHOICES, default="rle")
+    parser.add_argument("--codec_stats", help="Print compression ratio and encode time of each compressed array.", action="store_true")
+    parser.add_argument("--verify", help="Check that compressed arrays decompress to the original data.", action="store_true")
+    parser.add_argument("--packing", help="Palette packing engine. \"optimal\" searches for a packing with fewer palettes than the greedy first-fit.", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--packing_time", help="Time budget in seconds for optimal palette packing.", type=float, default=1.0)
+    cache.add_arguments(parser)
+    profiler.add_arguments(parser)
+    return parser
+
+
+def make_options(**kwargs):
+    return cli.make_options(build_parser(), **kwargs)
 
-    args = parser.parse_args()
 
-    source = png.Reader(args.infile)
-    width, height, data_map, meta = source.read()
+def convert_border(data, colors, options=None):
+    # data is a (height, width) array of indices into the RGBA palette colors.
+    if options is None:
+        options = make_options()
+
+    height, width = np.shape(data)
 
     tiles_x = width // 8
     tiles_y = height // 8
 
-    data = np.array(list(data_map)).transpose()
-
     if width % 8 != 0 or height % 8 != 0:
         raise ValueError("Image dimensions not divisible by 8.")
-    if "palette" not in meta:
-        raise ValueError("PNG image is not indexed.")
-
-    data, colors = consolidate_transparent(data, width, height, meta["palette"])
-    palettes, palette_map = make_palettes(data, width, height, colors)
-    tile_data = []
-    tile_data = [convert_tile(data, palette_map[palettes[tx+ty*tiles_x]], tx, ty) for ty in range(tiles_y) for tx in range(tiles_x)]
-    tile_data_length = len(tile_data)
-
-    tile_map = dict()
-    tiles = []
-    for tile in tile_data:
-        if tile not in tile_map:
-            tile_map[tile] = len(tile_map)
-        tiles.append(tile_map[tile])
-
-    tile_data = np.zeros(32 * len(tile_map), np.uint8)
-    for k,v in tile_map.items():
-        tile_data[(v*32):(v+1)*32] = k
+
+    data = np.array(data).transpose()
+
+    with profiler.stage("palette"):
+        data, colors = consolidate_transparent(data, width, height, colors)
+        info = {}
+        if options.packing == "optimal":
+            info["palettes_greedy"] = len(make_palettes(data, width, height, colors)[1])
+
+        palettes, palette_map = make_palettes(data, width, height, colors, options.packing, options.packing_time)
+        info["palettes"] = len(palette_map)
+
+    with profiler.stage("encode"):
+        td = tiledata.get_tiles(data, tiles_x, tiles_y)
+        td = tiledata.remap_tiles(td, palettes, palette_map, len(colors))
+        encoded = tiledata.encode_4bpp(td)
+
+    with profiler.stage("dedup"):
+        tile_index = tiledata.TileIndex(tile_size=32)
+        tiles, _ = tile_index.add(encoded)
+        tile_data = tile_index.data()
 
     palette_data = []
     for m in palette_map:
@@ -138,9 +144,44 @@ def main():
             else:
                 palette_data.append(palette_to_15bit(0, 0, 0, 0))
 
-    palettes = [(i+4) << 2 for i in palettes]
+    palettes = (np.array(palettes) + 4) << 2
+
+    return export.ConversionResult(tile_data, tiles, tiles_x, tiles_y, palettes, np.array(palette_data, np.uint16), info=info)
+
+
+def write_result(result, options, outfile, stats=None):
+    export.write_border_c_header(outfile, result.tile_data, result.tiles, result.palettes, result.palette_data, rle=options.rle, codec=options.codec, verify=options.verify, stats=stats)
+
+
+def convert_file(args):
+    with profiler.stage("decode"):
+        data, meta = image.read_png(args.infile)
+        if "palette" not in meta:
+            raise ValueError("PNG image is not indexed.")
+
+    result = convert_border(data, meta["palette"], args)
+    profiler.metric("tiles", result.tiles_width * result.tiles_height)
+    profiler.metric("unique_tiles", len(result.tile_data) // 32)
+    profiler.metric("palettes", result.info["palettes"])
+
+    stats = [] if args.codec_stats else None
+    with profiler.stage("emit"):
+        write_result(result, args, args.outfile, stats)
+
+    if "palettes_greedy" in result.info:
+        print(packing.report(result.info))
+    if stats:
+        print(compression.format_stats(stats))
+
+
+def run(args):
+    if profiler.enabled(args):
+        return profiler.run(args, convert_file)
+    return cache.run_cached("imgtosgb", args, ("infile",), ("outfile",), convert_file)
+
 
-    export.write_border_c_header(args.outfile, tile_data, tiles, palettes, palette_data, rle=args.rle)
+def main(argv=None):
+    run(build_parser().parse_args(argv))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+import numpy as np
+import tiledata
+
+# State of the previous conversion of a map, kept in a sidecar file next to
+# the output so the next conversion only processes the tiles that changed.
+
+
+STATE_KEYS = ("signature", "hashes", "palettes", "palette_map", "unique", "indices", "attributes")
+
+
+def state_path(outfile):
+    return outfile + ".state"
+
+
+def signature(options, colors, width, height, extra=()):
+    # state can only be reused for the same options, colors, dimensions and
+    # extra values such as the rows of an included palette image
+    keys = ("color", "s8x16", "flip", "packing", "packing_time", "include_palette")
+    return json.dumps([[getattr(options, k) for k in keys], [list(c) for c in colors], width, height, list(extra)])
+
+
+def tile_hashes(tiles):
+    data = np.ascontiguousarray(tiles, np.uint8).tobytes()
+    size = 64
+    return np.frombuffer(b"".join(hashlib.blake2b(data[i:i+size], digest_size=8).digest() for i in range(0, len(data), size)), np.uint64)
+
+
+def pack_palette_map(palette_map):
+    out = np.full((len(palette_map), 4), -1, np.int32)
+    for i, m in enumerate(palette_map):
+        out[i, :len(m)] = m
+    return out
+
+
+def unpack_palette_map(packed):
+    return [[int(c) for c in row if c >= 0] for row in packed]
+
+
+def load_state(path, keys=STATE_KEYS):
+    # Returns the stored arrays, or None if there is no readable state.
+    try:
+        with np.load(path, allow_pickle=False) as f:
+            return {k: f[k] for k in keys}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_state(path, state):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(f, **state)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def update_tiles(unique, indices, attributes, dirty, encoded, flip=False):
+    # Dedups the encoded dirty tiles against the unique tiles of the previous
+    # conversion. Unchanged tiles keep their index. New unique tiles take the
+    # slots of tiles that are no longer used before being appended, and
+    # unused slots at the end are dropped. Returns the unique tiles and the
+    # index and attributes of each tile.
+    index = tiledata.TileIndex(flip)
+    index.add(unique)
+    count = len(index)
+
+    indices, attributes = indices.copy(), attributes.copy()
+    indices[dirty], attributes[dirty] = index.add(encoded)
+
+    data = index.data().reshape(-1, 16)
+    used = np.zeros(len(data), bool)
+    used[indices] = True
+    free = np.flatnonzero(~used[:count])
+    added = np.arange(count, len(data))
+
+    n = min(len(free), len(added))
+    slot = np.arange(len(data))
+    slot[added[:n]] = free[:n]
+    slot[added[n:]] = count + np.arange(len(added) - n)
+
+    out = np.concatenate((data[:count], data[added[n:]]))
+    out[free[:n]] = data[added[:n]]
+    indices = slot[indices]
+
+    end = indices.max() + 1 if len(indices) > 0 else 0
+    return out[:end], indices, attributes
@@ -1,4 +1,13 @@
+import os
 import math
+import hashlib
+import numpy as np
+import cache
+
+
+LCD_TABLE_FILE = "lcd_table_{}.npy"
+
+_lcd_table = None
 
 
 def correct_curve(x):
@@ -20,7 +29,20 @@ def emulate_lcd(c):
 
 
 def build_lcd_map():
-    return [emulate_lcd(c) for c in range(2**15)]
+    c = np.arange(2**15)
+    r = (c & 0x1F) / 31
+    g = ((c >> 5) & 0x1F) / 31
+    b = ((c >> 10) & 0x1F) / 31
+
+    r, g, b = [1 - (np.cos(x * np.pi) / 2 + 0.5) for x in (r, g, b)]
+
+    g = (g * 3 + b) / 4
+
+    return np.stack([np.round(x * 31) for x in (r, g, b)], axis=1).astype(np.int32)
+
+
+def pack_colors(rgb):
+    return rgb[..., 0] + (rgb[..., 1] << 5) + (rgb[..., 2] << 10)
 
 
 def find_best(c, lcd_map):
@@ -28,13 +50,90 @@ def find_best(c, lcd_map):
     g = ((c >> 5) & 0x1F)
     b = ((c >> 10) & 0x1F)
 
-    best_dist = 0
-    best_color = None
+    lcd_map = np.asarray(lcd_map)
+    dist = (r - lcd_map[:, 0])**2 + (g - lcd_map[:, 1])**2 + (b - lcd_map[:, 2])**2
+
+    return int(pack_colors(lcd_map[np.argmin(dist)]))
+
+
+def build_lcd_table():
+    # Computes find_best for every 15-bit color. Candidates are looked up in a
+    # 32x32x32 grid holding the first lcd_map index emulating to each color,
+    # visiting grid offsets in order of increasing distance, so ties resolve to
+    # the earliest lcd_map entry like the linear scan in find_best.
+    lcd_map = build_lcd_map()
+    packed = pack_colors(lcd_map)
+
+    none = 2**15
+    first = np.full(2**15, none, np.int32)
+    np.minimum.at(first, packed, np.arange(2**15, dtype=np.int32))
+
+    d = np.arange(-31, 32)
+    offsets = np.stack(np.meshgrid(d, d, d, indexing="ij"), axis=-1).reshape(-1, 3)
+    dist = (offsets**2).sum(axis=1)
+    order = np.argsort(dist, kind="stable")
+    offsets, dist = offsets[order], dist[order]
+    levels = np.flatnonzero(np.diff(dist)) + 1
+    levels = np.concatenate(([0], levels, [len(dist)]))
+
+    query = np.arange(2**15)
+    rgb = np.stack([query & 0x1F, (query >> 5) & 0x1F, (query >> 10) & 0x1F], axis=1)
+    result = np.zeros(2**15, np.int32)
+    active = query
+
+    for start, end in zip(levels[:-1], levels[1:]):
+        if len(active) == 0:
+            break
+        best = np.full(len(active), none, np.int32)
+        for off in offsets[start:end]:
+            c = rgb[active] + off
+            valid = ((c >= 0) & (c < 32)).all(axis=1)
+            cand = np.full(len(active), none, np.int32)
+            cand[valid] = first[pack_colors(c[valid])]
+            np.minimum(best, cand, out=best)
+        hit = best != none
+        result[active[hit]] = best[hit]
+        active = active[~hit]
+
+    return packed[result].astype(np.uint16)
+
+
+def lcd_table_path():
+    # keyed on the source of this module, so a changed correction never
+    # reuses a table built by an older version
+    with open(os.path.abspath(__file__), "rb") as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:16]
+    return os.path.join(cache.cache_dir(), LCD_TABLE_FILE.format(version))
+
+
+def get_lcd_table():
+    global _lcd_table
+    if _lcd_table is not None:
+        return _lcd_table
+
+    path = lcd_table_path()
+    try:
+        table = np.load(path, mmap_mode="r")
+        if table.shape == (2**15,) and table.dtype == np.uint16:
+            _lcd_table = table
+            return table
+    except (OSError, ValueError):
+        pass
+
+    table = build_lcd_table()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            np.save(f, table)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+    _lcd_table = table
+    return table
 
-    for c2 in lcd_map:
-        dist = (r - c2[0])**2 + (g - c2[1])**2 + (b - c2[2])**2
-        if best_color == None or dist < best_dist:
-            best_color = c2
-            best_dist = dist
 
-    return best_color[0] + (best_color[1] << 5) + (best_color[2] << 10)
+def correct_colors(palette_data):
+    table = get_lcd_table()
+    return [int(c) for c in table[np.asarray(palette_data, np.intp)]]
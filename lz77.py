@@ -0,0 +1,101 @@
+import numpy as np
+
+# Byte oriented LZ77 format, decoded by the decoders in asm/:
+#   0x00                end of stream
+#   0x01-0x7F n         copy the following n literal bytes
+#   0x80-0xFF lo hi     copy (n & 0x7F) + LZ_MIN_MATCH bytes starting
+#                       (hi << 8 | lo) bytes back in the output
+# Matches may overlap the bytes they produce, so a distance of 1 repeats the
+# previous byte.
+
+LZ_MIN_MATCH = 4
+LZ_MAX_MATCH = 0x7F + LZ_MIN_MATCH
+LZ_MAX_LITERALS = 0x7F
+LZ_WINDOW = 0xFFFF
+LZ_MAX_CHAIN = 32
+
+
+def compress(data):
+    data = np.asarray(data)
+    if len(data) > 0 and (data.min() < 0 or data.max() > 255):
+        raise ValueError("LZ77 compression only supports byte values.")
+    src = bytes(data.astype(np.uint8))
+    n = len(src)
+
+    out = bytearray()
+    literals = bytearray()
+    head = {}
+    prev = [0] * n
+
+    def flush_literals():
+        for i in range(0, len(literals), LZ_MAX_LITERALS):
+            chunk = literals[i:i+LZ_MAX_LITERALS]
+            out.append(len(chunk))
+            out.extend(chunk)
+        literals.clear()
+
+    def insert(i):
+        key = src[i:i+LZ_MIN_MATCH]
+        prev[i] = head.get(key, -1)
+        head[key] = i
+
+    i = 0
+    while i < n:
+        best_len, best_dist = 0, 0
+        if i + LZ_MIN_MATCH <= n:
+            limit = min(LZ_MAX_MATCH, n - i)
+            j = head.get(src[i:i+LZ_MIN_MATCH], -1)
+            chain = 0
+            while j >= 0 and i - j <= LZ_WINDOW and chain < LZ_MAX_CHAIN:
+                length = LZ_MIN_MATCH
+                while length < limit and src[j+length] == src[i+length]:
+                    length += 1
+                if length > best_len:
+                    best_len, best_dist = length, i - j
+                    if length == limit:
+                        break
+                j = prev[j]
+                chain += 1
+
+        if best_len >= LZ_MIN_MATCH:
+            flush_literals()
+            out.append(0x80 | (best_len - LZ_MIN_MATCH))
+            out.append(best_dist & 0xFF)
+            out.append(best_dist >> 8)
+            for k in range(i, min(i + best_len, n - LZ_MIN_MATCH + 1)):
+                insert(k)
+            i += best_len
+        else:
+            literals.append(src[i])
+            if i + LZ_MIN_MATCH <= n:
+                insert(i)
+            i += 1
+
+    flush_literals()
+    out.append(0)
+
+    return np.frombuffer(bytes(out), np.uint8)
+
+
+def decompress(data):
+    src = bytes(np.asarray(data, np.uint8))
+    out = bytearray()
+
+    i = 0
+    while True:
+        c = src[i]
+        i += 1
+        if c == 0:
+            break
+        if c & 0x80:
+            length = (c & 0x7F) + LZ_MIN_MATCH
+            dist = src[i] | (src[i+1] << 8)
+            i += 2
+            start = len(out) - dist
+            for k in range(length):
+                out.append(out[start + k])
+        else:
+            out.extend(src[i:i+c])
+            i += c
+
+    return np.frombuffer(bytes(out), np.uint8)
@@ -0,0 +1,62 @@
+import numpy as np
+import tiledata
+
+# Metasprite tables use the layout of GBDK's metasprite_t, four bytes per
+# sprite: the signed Y and X offset in pixels from the previous sprite, or
+# from the top-left corner of the frame for the first one, the tile number
+# and the OAM attributes. Each frame's table ends with a Y offset of
+# METASPRITE_END, GBDK's metasprite_end.
+
+METASPRITE_END = 0x80
+
+
+def build(units, units_x, units_y, frame_width, frame_height, unit_height=8, flip=False, palettes=None, offset=0):
+    # units is an (N, 16) array of packed sprite tiles, or (N, 32) in 8x16
+    # mode, in row-major order over a units_x by units_y grid. Frames of
+    # frame_width by frame_height units are taken in row-major order. Empty
+    # sprites are dropped and the others deduplicated over all frames, with
+    # flipped matches if flip is set. palettes holds the CGB palette of each
+    # unit, if any. Returns the unique tile data and the metasprite table of
+    # each frame as an (M, 4) array of bytes.
+    units = np.asarray(units, np.uint8)
+    if units_x % frame_width != 0 or units_y % frame_height != 0:
+        raise ValueError("Sheet size not divisible by frame size.")
+
+    frames_x = units_x // frame_width
+    frames_y = units_y // frame_height
+
+    y, x = np.divmod(np.arange(units_x * units_y), units_x)
+    frame = (y // frame_height) * frames_x + x // frame_width
+    order = np.lexsort((x, y, frame))
+    order = order[units[order].any(axis=1)]
+
+    index = tiledata.TileIndex(flip=flip, tile_size=units.shape[1])
+    indices, attributes = index.add(units[order])
+    if palettes is not None:
+        attributes |= np.asarray(palettes, np.uint8)[order]
+
+    tiles = indices * (units.shape[1] // 16) + offset
+    if len(tiles) > 0 and tiles.max() > 255:
+        raise ValueError("Metasprite tile numbers exceed 255.")
+
+    bounds = np.searchsorted(frame[order], np.arange(frames_x * frames_y + 1))
+
+    # offsets are relative to the previous sprite of the same frame
+    position = np.stack(((y[order] % frame_height) * unit_height, (x[order] % frame_width) * 8), axis=1)
+    delta = np.diff(position, axis=0, prepend=np.zeros((1, 2), np.intp))
+    first = bounds[:-1][bounds[:-1] < len(position)]
+    delta[first] = position[first]
+    if len(delta) > 0 and (delta.min() < -127 or delta.max() > 127):
+        raise ValueError("Metasprite offsets between sprites exceed -127 to 127 pixels, frames are too large.")
+
+    entries = np.stack((delta[:, 0], delta[:, 1], tiles, attributes), axis=1) & 0xFF
+    frames = [entries[bounds[i]:bounds[i+1]] for i in range(frames_x * frames_y)]
+
+    return index.data(), frames
+
+
+def report(frames, tile_data, raw_tiles):
+    sprites = sum(len(f) for f in frames)
+    raw_bytes = raw_tiles * 16
+    return "{} frames, {} sprites, {} tiles ({} bytes) instead of {} tiles ({} bytes), saved {} bytes of VRAM.".format(
+        len(frames), sprites, len(tile_data) // 16, len(tile_data), raw_tiles, raw_bytes, raw_bytes - len(tile_data))
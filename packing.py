@@ -0,0 +1,154 @@
+import sys
+import time
+from tiledata import mask_colors
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def absorb(masks):
+    # drop color sets contained in another set, they fit wherever that set goes
+    kept = []
+    for m in sorted(set(masks), key=lambda m: (-m.bit_count(), m)):
+        if not any(m & k == m for k in kept):
+            kept.append(m)
+    return kept
+
+
+def best_fit(sets, bins, caps, size):
+    # place each set in the fitting palette needing the fewest new colors
+    bins, caps = list(bins), list(caps)
+    for m in sets:
+        best, best_add = -1, 0
+        for i, b in enumerate(bins):
+            add = (m & ~b).bit_count()
+            if b.bit_count() + add <= caps[i] and (best == -1 or add < best_add):
+                best, best_add = i, add
+        if best == -1:
+            bins.append(m)
+            caps.append(size)
+        else:
+            bins[best] |= m
+    return bins
+
+
+def search(sets, bins, caps, size, limit, deadline):
+    # Depth-first branch and bound over palette assignments, looking for a
+    # packing using fewer than limit palettes. Returns None if none exists.
+    # Raises SearchTimeout when the deadline passes.
+    remaining = [0] * (len(sets) + 1)
+    for k in range(len(sets) - 1, -1, -1):
+        remaining[k] = remaining[k+1] | sets[k]
+
+    bins, caps = list(bins), list(caps)
+    visited = [0]
+
+    def dfs(k):
+        visited[0] += 1
+        if visited[0] % 256 == 0 and time.monotonic() > deadline:
+            raise SearchTimeout()
+
+        if k == len(sets):
+            return list(bins)
+
+        # colors not in any palette yet that don't fit in the free slots
+        # need at least this many more palettes
+        covered = 0
+        free = 0
+        for b, c in zip(bins, caps):
+            covered |= b
+            free += c - b.bit_count()
+        uncovered = (remaining[k] & ~covered).bit_count()
+        if len(bins) + max(0, -(-(uncovered - free) // size)) >= limit:
+            return None
+
+        m = sets[k]
+        options = []
+        for i, b in enumerate(bins):
+            add = (m & ~b).bit_count()
+            if b.bit_count() + add <= caps[i]:
+                options.append((add, i))
+        options.sort()
+
+        seen = set()
+        for add, i in options:
+            if (bins[i], caps[i]) in seen:
+                continue
+            seen.add((bins[i], caps[i]))
+            old = bins[i]
+            bins[i] |= m
+            found = dfs(k + 1)
+            bins[i] = old
+            if found is not None:
+                return found
+
+        if len(bins) + 1 < limit:
+            bins.append(m)
+            caps.append(size)
+            found = dfs(k + 1)
+            bins.pop()
+            caps.pop()
+            if found is not None:
+                return found
+
+        return None
+
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, len(sets) + 1000))
+    try:
+        return dfs(0)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+
+def pack(masks, size, palette_map=None, time_budget=1.0):
+    # Packs tile color sets, given as bitmasks, into as few palettes of size
+    # colors as possible. Palettes already in palette_map are kept in order
+    # and may be extended. Starts from a best-fit decreasing packing and then
+    # searches for packings with fewer palettes until time_budget seconds
+    # have passed. Returns the palette index of each mask and the palette map.
+    palette_map = [list(p) for p in (palette_map or [])]
+    initial = [sum(1 << int(v) for v in set(p)) for p in palette_map]
+    caps = [size - (len(p) - b.bit_count()) for p, b in zip(palette_map, initial)]
+
+    sets = [m for m in absorb(masks) if not any(m & b == m for b in initial)]
+    bins = best_fit(sets, initial, caps, size)
+
+    union = 0
+    for m in sets:
+        union |= m
+    for b in initial:
+        union |= b
+    lower = max(len(initial), -(-union.bit_count() // size))
+
+    deadline = time.monotonic() + time_budget
+    try:
+        while time_budget > 0 and len(bins) > lower:
+            found = search(sets, initial, caps, size, len(bins), deadline)
+            if found is None:
+                break
+            bins = found
+    except SearchTimeout:
+        pass
+
+    for i in range(len(bins)):
+        if i < len(palette_map):
+            palette_map[i].extend(mask_colors(bins[i] & ~initial[i]))
+        else:
+            palette_map.append(mask_colors(bins[i]))
+
+    memo = {}
+    palettes = []
+    for m in masks:
+        index = memo.get(m)
+        if index is None:
+            index = next(i for i, b in enumerate(bins) if m & b == m)
+            memo[m] = index
+        palettes.append(index)
+
+    return palettes, palette_map
+
+
+def report(info):
+    return "Packed {} palettes (greedy: {}, saved {}).".format(info["palettes"], info["palettes_greedy"], info["palettes_greedy"] - info["palettes"])
@@ -0,0 +1,162 @@
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+# Per-stage instrumentation for the command line tools. Conversion code marks
+# stages with stage() and reports numbers with metric() and array(). These do
+# nothing unless a Recorder is active.
+
+_active = None
+
+
+class Recorder:
+    # Records the wall time and peak traced memory of each stage. Times and
+    # memory of nested stages are not counted in the enclosing stage.
+    def __init__(self):
+        self.stages = {}
+        self.metrics = {}
+        self.arrays = []
+        self.frames = []
+        self.total = 0.0
+
+    def enter(self, name):
+        now = time.perf_counter()
+        current = tracemalloc.get_traced_memory()[0]
+        if self.frames:
+            parent = self.frames[-1]
+            parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.frames.append({"name": name, "start": now, "child": 0.0, "base": current, "peak": current})
+
+    def exit(self):
+        frame = self.frames.pop()
+        elapsed = time.perf_counter() - frame["start"]
+        peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+
+        s = self.stages.setdefault(frame["name"], {"calls": 0, "time": 0.0, "alloc": 0})
+        s["calls"] += 1
+        s["time"] += elapsed - frame["child"]
+        s["alloc"] = max(s["alloc"], peak - frame["base"])
+
+        if self.frames:
+            parent = self.frames[-1]
+            parent["child"] += elapsed
+            parent["peak"] = max(parent["peak"], peak)
+        tracemalloc.reset_peak()
+
+    def results(self):
+        return {
+            "total": self.total,
+            "stages": self.stages,
+            "metrics": self.metrics,
+            "arrays": self.arrays
+        }
+
+
+@contextmanager
+def stage(name):
+    recorder = _active
+    if recorder is None:
+        yield
+        return
+    recorder.enter(name)
+    try:
+        yield
+    finally:
+        recorder.exit()
+
+
+def iterate(name, iterable):
+    # Yields from iterable, timing the production of each item as stage name.
+    it = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def metric(name, value):
+    if _active is not None:
+        _active.metrics[name] = value
+
+
+def array(name, raw, compressed, codec=None):
+    if _active is not None:
+        _active.arrays.append({"name": name, "codec": codec, "raw": raw, "compressed": compressed})
+
+
+def format_results(results):
+    total = results["total"]
+    lines = ["{:<10} {:>6} {:>10} {:>7} {:>10}".format("stage", "calls", "time", "share", "alloc")]
+    for name, s in sorted(results["stages"].items(), key=lambda x: -x[1]["time"]):
+        lines.append("{:<10} {:>6} {:>8.2f}ms {:>6.1f}% {:>8.0f}kB".format(
+            name, s["calls"], 1000 * s["time"], 100 * s["time"] / total if total else 0, s["alloc"] / 1024))
+    lines.append("{:<10} {:>6} {:>8.2f}ms".format("total", "", 1000 * total))
+
+    if results["metrics"]:
+        lines.append("")
+        for name, value in results["metrics"].items():
+            lines.append("{:<16} {}".format(name, value))
+
+    if results["arrays"]:
+        lines.append("")
+        lines.append("{:<24} {:<6} {:>8} {:>10} {:>7}".format("array", "codec", "raw", "compressed", "ratio"))
+        for a in results["arrays"]:
+            lines.append("{:<24} {:<6} {:>8} {:>10} {:>6.1f}%".format(
+                a["name"], a["codec"] or "", a["raw"], a["compressed"], 100 * a["compressed"] / a["raw"] if a["raw"] else 100))
+
+    return "\n".join(lines)
+
+
+def enabled(args):
+    return bool(getattr(args, "stats", None) or getattr(args, "profile", None))
+
+
+def record(convert, args, trace=False):
+    # Runs convert(args) with a Recorder active and returns the recorder.
+    # Memory is only recorded with trace set, as tracing slows the run.
+    global _active
+    recorder = Recorder()
+    tracing = tracemalloc.is_tracing()
+    if trace and not tracing:
+        tracemalloc.start()
+    _active = recorder
+    start = time.perf_counter()
+    try:
+        convert(args)
+    finally:
+        recorder.total = time.perf_counter() - start
+        _active = None
+        if trace and not tracing:
+            tracemalloc.stop()
+    return recorder
+
+
+def run(args, convert):
+    # Runs convert(args) recording stages, then prints the results in the
+    # format given by --stats and writes a cProfile dump to --profile.
+    profile = cProfile.Profile() if args.profile else None
+    if profile is not None:
+        recorder = record(lambda a: profile.runcall(convert, a), args, bool(args.stats))
+        profile.dump_stats(args.profile)
+    else:
+        recorder = record(convert, args, bool(args.stats))
+
+    if args.stats == "json":
+        json.dump(recorder.results(), sys.stdout, indent=2)
+        print()
+    elif args.stats:
+        print(format_results(recorder.results()))
+
+    return False
+
+
+def add_arguments(parser):
+    parser.add_argument("--stats", help="Print time and allocated memory of each conversion stage along with asset metrics, as a table or JSON. Disables the cache.", nargs="?", const="table", choices=["table", "json"])
+    parser.add_argument("--profile", help="Write a cProfile dump of the conversion to file. Disables the cache.", type=str)
@@ -1,29 +1,51 @@
+import numpy as np
+
 RLE_MAX_RUN = 255
 
+# A run of one value is stored as the value itself. Longer runs are stored as
+# the value twice followed by the run length, split into runs of at most
+# RLE_MAX_RUN values.
+
 def compress(data):
+    data = np.asarray(data)
     if len(data) == 0:
-        return []
+        return data[:0]
 
-    value = data[0]
-    run, i = 1, 1
-    out = []
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(data)))
 
-    while i < len(data):
-        if data[i] == data[i-1] and run < RLE_MAX_RUN:
-            run = run + 1
-        else:
-            out.append(data[i-1])
-            if run > 1:
-                out.append(data[i-1])
-                out.append(run)
-            run = 1
-        i = i + 1
-
-    out.append(data[-1])
-    if run > 1:
-        out.append(data[-1])
-        out.append(run)
+    # split long runs into chunks of at most RLE_MAX_RUN
+    chunks = (lengths + RLE_MAX_RUN - 1) // RLE_MAX_RUN
+    run = np.repeat(np.arange(len(starts)), chunks)
+    first = np.repeat(np.cumsum(chunks) - chunks, chunks)
+    length = np.minimum(lengths[run] - (np.arange(len(run)) - first) * RLE_MAX_RUN, RLE_MAX_RUN)
+    values = data[starts[run]]
+
+    sizes = np.where(length > 1, 3, 1)
+    pos = np.cumsum(sizes) - sizes
+    out = np.empty(pos[-1] + sizes[-1], np.result_type(data.dtype, np.uint8))
+    out[pos] = values
+    multi = length > 1
+    out[pos[multi] + 1] = values[multi]
+    out[pos[multi] + 2] = length[multi]
 
     return out
 
 
+def decompress(data):
+    data = np.asarray(data)
+    values, counts = [], []
+
+    i, n = 0, len(data)
+    while i < n:
+        v = data[i]
+        if i + 2 < n and data[i+1] == v:
+            values.append(v)
+            counts.append(data[i+2])
+            i = i + 3
+        else:
+            values.append(v)
+            counts.append(1)
+            i = i + 1
+
+    return np.repeat(np.array(values, data.dtype), np.array(counts, np.intp))
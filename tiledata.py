@@ -0,0 +1,139 @@
+import numpy as np
+
+
+def get_tiles(data, tiles_x, tiles_y):
+    # data is indexed by [x, y]; returns an (N, 8, 8) array indexed by [tile, y, x]
+    # with tiles in row-major order
+    td = np.asarray(data).T[:tiles_y*8, :tiles_x*8]
+    return td.reshape(tiles_y, 8, tiles_x, 8).transpose(0, 2, 1, 3).reshape(-1, 8, 8)
+
+
+def tile_order(tiles_x, tiles_y, s8x16=False):
+    if s8x16:
+        return np.array([(x // 2) + (y + x % 2) * tiles_x for y in range(0, tiles_y, 2) for x in range(tiles_x*2)], np.intp)
+    return np.arange(tiles_x * tiles_y, dtype=np.intp)
+
+
+def remap_tiles(tiles, tile_palettes, palette_map, ncolors):
+    lut = np.zeros((max(len(palette_map), 1), max(ncolors, 1)), np.uint8)
+    for p, m in enumerate(palette_map):
+        for i, c in enumerate(m):
+            lut[p, c] = i
+    return lut[np.asarray(tile_palettes, np.intp)[:, None, None], tiles]
+
+
+def encode_2bpp(tiles):
+    tiles = np.asarray(tiles, np.uint8)
+    b0 = np.packbits(tiles & 1, axis=2)
+    b1 = np.packbits((tiles >> 1) & 1, axis=2)
+    return np.ascontiguousarray(np.concatenate((b0, b1), axis=2).reshape(-1))
+
+
+def encode_4bpp(tiles):
+    # SNES format: bitplanes 0/1 interleaved for all rows, followed by bitplanes 2/3
+    tiles = np.asarray(tiles, np.uint8)
+    low = encode_2bpp(tiles & 3).reshape(-1, 16)
+    high = encode_2bpp(tiles >> 2).reshape(-1, 16)
+    return np.ascontiguousarray(np.hstack((low, high)).reshape(-1))
+
+
+class TileCache:
+    # Remembers the pixel tiles and 2bpp encoding of the previous image, so a
+    # new revision of the same image only encodes the tiles that changed.
+    def __init__(self):
+        self.tiles = None
+        self.encoded = None
+        self.dirty = None
+
+    def encode_2bpp(self, tiles):
+        tiles = np.asarray(tiles, np.uint8)
+        if self.tiles is None or self.tiles.shape != tiles.shape:
+            self.dirty = np.arange(len(tiles), dtype=np.intp)
+            self.encoded = encode_2bpp(tiles).reshape(-1, 16)
+        else:
+            self.dirty = np.flatnonzero((tiles != self.tiles).any(axis=(1, 2)))
+            self.encoded = self.encoded.copy()
+            self.encoded[self.dirty] = encode_2bpp(tiles[self.dirty]).reshape(-1, 16)
+        self.tiles = tiles.copy()
+        return self.encoded.reshape(-1)
+
+
+FLIP_X = 0x20
+FLIP_Y = 0x40
+PRIORITY = 0x80
+
+_reverse_bits = np.array([int("{:08b}".format(i)[::-1], 2) for i in range(256)], np.uint8)
+
+
+def flip_x_2bpp(tile_data):
+    return _reverse_bits[tile_data]
+
+
+def flip_y_2bpp(tile_data):
+    # reverses the rows of each tile, (N, 32) arrays of 8x16 sprites are
+    # flipped as a whole
+    tile_data = np.asarray(tile_data)
+    size = tile_data.shape[-1] if tile_data.ndim > 1 else 16
+    return tile_data.reshape(-1, size // 2, 2)[:, ::-1].reshape(-1, size)
+
+
+class TileIndex:
+    # Deduplicates packed 2bpp tiles in order of first appearance. With flip
+    # enabled, tiles matching an X, Y or XY flipped version of a known tile are
+    # mapped to that tile along with the CGB BG attribute flip bits.
+    def __init__(self, flip=False, tile_size=16):
+        self.flip = flip
+        self.tile_size = tile_size
+        self.lookup = dict()
+        self.tiles = []
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def add(self, tile_data):
+        tile_data = np.asarray(tile_data, np.uint8).reshape(-1, self.tile_size)
+        variants = [tile_data]
+        if self.flip:
+            fx = flip_x_2bpp(tile_data)
+            variants += [fx, flip_y_2bpp(tile_data), flip_y_2bpp(fx)]
+        variants = [v.tobytes() for v in variants]
+        flips = [0, FLIP_X, FLIP_Y, FLIP_X | FLIP_Y]
+
+        indices = np.zeros(len(tile_data), np.intp)
+        attributes = np.zeros(len(tile_data), np.uint8)
+        size = self.tile_size
+        for i in range(len(tile_data)):
+            start = i * size
+            key = variants[0][start:start+size]
+            hit = self.lookup.get(key)
+            if hit is None:
+                hit = (len(self.tiles), 0)
+                self.tiles.append(key)
+                for v, f in zip(variants, flips):
+                    self.lookup.setdefault(v[start:start+size], (hit[0], f))
+            indices[i], attributes[i] = hit
+        return indices, attributes
+
+    def data(self):
+        return np.frombuffer(b"".join(self.tiles), np.uint8)
+
+
+def color_masks(tiles, ncolors):
+    # Returns the set of colors used by each tile as an integer bitmask with
+    # bit c set for color c, together with the number of colors per tile.
+    tiles = np.asarray(tiles)
+    tiles = tiles.reshape(len(tiles), tiles[0].size if len(tiles) else 0)
+    used = np.zeros((len(tiles), max(ncolors, 1)), bool)
+    used[np.arange(len(tiles))[:, None], tiles] = True
+    packed = np.packbits(used, axis=1, bitorder="little")
+    masks = [int.from_bytes(row.tobytes(), "little") for row in packed]
+    return masks, used.sum(axis=1)
+
+
+def mask_colors(mask):
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(low.bit_length() - 1)
+        mask ^= low
+    return out
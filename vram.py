@@ -0,0 +1,71 @@
+import numpy as np
+
+# Background tile numbers address VRAM in one of two modes, selected by bit 4
+# of LCDC. In $8000 mode tile numbers 0 to 255 are the tiles at $8000-$8FFF.
+# In $8800 mode tile numbers are signed and -128 to 127 are the tiles at
+# $8800-$97FF, with tile 0 at $9000. The CGB has a second VRAM bank, selected
+# per map entry by bit 3 of the BG attributes.
+
+BANK_BIT = 0x08
+
+# first and last tile number and the address of tile 0 in each mode
+MODES = {
+    "8000": (0, 255, 0x8000),
+    "8800": (-128, 127, 0x9000)
+}
+
+
+def address(mode, number):
+    return MODES[mode][2] + number * 16
+
+
+def slots(mode, offset=0, budget=None):
+    # Returns the tile numbers available to the map in one bank, starting at
+    # offset in the order of their addresses.
+    first, last, base = MODES[mode]
+    if offset < first or offset > last:
+        raise ValueError("Tile offset {} is outside {} to {} in ${} mode.".format(offset, first, last, mode))
+    count = last + 1 - offset
+    if budget is not None:
+        if budget < 0:
+            raise ValueError("VRAM budget must be 0 or more tiles.")
+        count = min(count, budget)
+    return np.arange(offset, offset + count)
+
+
+def describe(mode, numbers):
+    if len(numbers) == 0:
+        return "no tiles"
+    return "tiles {} to {} at ${:04X}-${:04X}".format(numbers[0], numbers[-1], address(mode, numbers[0]), address(mode, numbers[-1]) + 15)
+
+
+def allocate(indices, count, tiles_x, mode, offset=0, budget=None, banks=1):
+    # indices holds the index of each map entry into count unique tiles, which
+    # are numbered in order of first appearance in the map. Fills bank 0
+    # before bank 1. Returns the tile number byte and bank of each map entry
+    # and the number of unique tiles in each bank.
+    indices = np.asarray(indices)
+    numbers = slots(mode, offset, budget)
+    per_bank = len(numbers)
+    capacity = per_bank * banks
+
+    if count > capacity:
+        first = int(np.argmax(indices >= capacity))
+        raise ValueError(overflow_report(mode, numbers, banks, count, first % tiles_x, first // tiles_x))
+
+    bank, slot = np.divmod(indices, max(per_bank, 1))
+    used = [min(max(count - b * per_bank, 0), per_bank) for b in range(banks)]
+    return (numbers[slot] & 0xFF).astype(np.uint8), bank.astype(np.uint8), used
+
+
+def overflow_report(mode, numbers, banks, count, x, y):
+    capacity = len(numbers) * banks
+    return "Map needs {} unique tiles but the VRAM budget holds {}: {} bank{} of {} in ${} mode. {} tiles do not fit, the first at map position ({},{}).".format(
+        count, capacity, banks, "" if banks == 1 else "s", describe(mode, numbers), mode, count - capacity, x, y)
+
+
+def report(mode, offset, used):
+    out = []
+    for b, n in enumerate(used):
+        out.append("bank {}: {}".format(b, describe(mode, np.arange(offset, offset + n))))
+    return "VRAM in ${} mode, {}.".format(mode, ", ".join(out))